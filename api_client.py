@@ -0,0 +1,82 @@
+import os
+
+import requests
+
+from codec import ACCEPT_ENCODING, dumps, loads
+from rate_limiter import THROTTLE_STATUSES, get_limiter
+
+# Set the base URL for your Portfolio API. PORTFOLIO_API_URL overrides it, e.g. to point the app
+# at a local mock backend.
+BASE_URL = os.environ.get("PORTFOLIO_API_URL", "http://localhost:8080/api")
+HEALTH_URL = BASE_URL.rstrip("/").removesuffix("/api") + "/health"
+
+
+# Error raised for API responses with an unexpected status code
+class APIError(Exception):
+    def __init__(self, status_code, message):
+        super().__init__(f"API Error [{status_code}]: {message}")
+        self.status_code = status_code
+        self.message = message
+
+
+# Number of times a request is retried after a 429/503 response
+MAX_RETRIES = 3
+
+
+# Function to send a single HTTP request
+def _send(http, method, url, headers, data):
+    if method == 'GET':
+        return http.get(url, headers=headers)
+    elif method == 'POST':
+        return http.post(url, headers=headers, data=dumps(data))
+    elif method == 'PUT':
+        return http.put(url, headers=headers, data=dumps(data))
+    elif method == 'DELETE':
+        return http.delete(url, headers=headers)
+
+
+# Function to send a request through the limiter of its endpoint family, retrying 429/503
+# responses after the backoff the limiter derives from Retry-After
+def _send_with_retries(http, method, url, headers, data, limiter):
+    for attempt in range(MAX_RETRIES + 1):
+        started = limiter.acquire()
+        try:
+            response = _send(http, method, url, headers, data)
+        except Exception:
+            # Connection errors and timeouts also tell the limiter to back off
+            limiter.release(started)
+            raise
+        limiter.release(started, response.status_code, response.headers.get('Retry-After'))
+        if response.status_code not in THROTTLE_STATUSES or attempt == MAX_RETRIES:
+            return response
+
+
+# Function to send an API request with JWT authentication and return the decoded JSON body.
+# Unlike make_request in main.py it does not touch Streamlit, so it can be called from worker threads.
+# `token` is a JWT or a TokenManager; with a TokenManager, a 401 response refreshes the token
+# and the request is retried once.
+# Requests go through the adaptive limiter of their endpoint family, and 429/503 responses
+# are retried after the backoff the limiter derives from Retry-After.
+# Bodies are encoded and decoded with the fastest installed JSON codec, and compressed
+# responses are requested explicitly.
+def api_request(endpoint, method='GET', data=None, token=None, session=None):
+    url = f"{BASE_URL}/{endpoint}"
+    if method not in ('GET', 'POST', 'PUT', 'DELETE'):
+        raise ValueError(f"Unsupported method: {method}")
+
+    http = session or requests
+    limiter = get_limiter(endpoint)
+    manager = token if hasattr(token, 'refresh') else None
+    for auth_attempt in range(2):
+        sent_token = manager.get() if manager else token
+        headers = {'Content-Type': 'application/json', 'Accept-Encoding': ACCEPT_ENCODING}
+        if sent_token:
+            headers['Authorization'] = f"Bearer {sent_token}"
+        response = _send_with_retries(http, method, url, headers, data, limiter)
+        if response.status_code != 401 or manager is None or auth_attempt:
+            break
+        manager.refresh(stale=sent_token)
+
+    if response.status_code in [200, 201]:
+        return loads(response.content) if response.content else {}
+    raise APIError(response.status_code, response.text)
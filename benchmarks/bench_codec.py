@@ -0,0 +1,96 @@
+"""Benchmark the JSON codecs and response compression on large transaction payloads.
+
+Starts a local stand-in for the Portfolio API (mock_backend.py) and, for every installed
+codec and every supported Content-Encoding, measures fetching and decoding one asset's
+transaction history. Also measures encoding the payload and flattening nested users.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_codec --transactions 200000
+"""
+import argparse
+import statistics
+import time
+
+import requests
+
+import codec
+from data_utils import flatten_data
+from mock_backend import MockBackend, MockData, brotli
+
+
+# Function to run fn repeats times and return the median duration in milliseconds and the last result
+def timed(fn, repeats):
+    durations = []
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        durations.append((time.perf_counter() - start) * 1000)
+    return statistics.median(durations), result
+
+
+def print_table(rows):
+    columns = list(rows[0])
+    widths = [max(len(str(c)), *(len(str(r[c])) for r in rows)) for c in columns]
+    print("  ".join(str(c).ljust(w) for c, w in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(row[c]).ljust(w) for c, w in zip(columns, widths)))
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--transactions", type=int, default=200000, help="Transactions in the benchmarked asset")
+    parser.add_argument("--users", type=int, default=20000, help="Users in the flattening benchmark")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    encodings = ["identity", "gzip", "deflate"] + (["br"] if brotli is not None and codec.HAS_BROTLI else [])
+    print(f"Codecs: {', '.join(codec.CODECS)}; encodings: {', '.join(encodings)}\n")
+
+    with MockBackend(users=1, portfolios_per_user=1, assets_per_portfolio=1,
+                     transactions_per_asset=args.transactions) as backend:
+        url = f"{backend.base_url}/transactions/asset/1"
+        session = requests.Session()
+        rows = []
+        for encoding in encodings:
+            headers = {"Authorization": "Bearer mock-token", "Accept-Encoding": encoding}
+            # Transfer (including decompression) is independent of the codec
+            fetch_ms, response = timed(lambda: session.get(url, headers=headers), args.repeats)
+            body = response.content
+            for name, json_codec in codec.CODECS.items():
+                decode_ms, payload = timed(lambda: json_codec.loads(body), args.repeats)
+                rows.append({
+                    "encoding": encoding,
+                    "codec": name,
+                    "wire_kb": int(response.headers["Content-Length"]) // 1024,
+                    "fetch_ms": round(fetch_ms, 1),
+                    "decode_ms": round(decode_ms, 1),
+                    "total_ms": round(fetch_ms + decode_ms, 1),
+                    "records": len(payload),
+                })
+        print(f"Fetch + decode of {args.transactions} transactions (median of {args.repeats})")
+        print_table(rows)
+
+    transactions = MockData(transactions_per_asset=args.transactions).transactions_for_asset(1)
+    rows = []
+    for name, json_codec in codec.CODECS.items():
+        encode_ms, body = timed(lambda: json_codec.dumps(transactions), args.repeats)
+        rows.append({"codec": name, "encode_ms": round(encode_ms, 1), "kb": len(body) // 1024})
+    print(f"Encoding {args.transactions} transactions")
+    print_table(rows)
+
+    data = MockData(users=args.users, portfolios_per_user=3)
+    users = [data.user(user_id) for user_id in range(1, args.users + 1)]
+    rows = []
+    for name in codec.CODECS:
+        codec.set_default_codec(name)
+        flatten_ms, _ = timed(lambda: flatten_data(users), args.repeats)
+        rows.append({"codec": name, "flatten_ms": round(flatten_ms, 1)})
+    print(f"Flattening {args.users} users with nested portfolios")
+    print_table(rows)
+
+
+if __name__ == "__main__":
+    main()
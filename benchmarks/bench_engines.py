@@ -0,0 +1,193 @@
+"""Benchmark the query engines on the pre-made query catalog.
+
+For every dataset size, builds synthetic users, portfolios, assets and transactions (the same
+records mock_backend.py serves), flattens them and builds the transaction fact table the way
+the app does. Then runs every pre-made query on every installed engine and reports the
+latency (registering the tables plus running the query, as in the app), the peak memory
+above the process's memory before the query, and whether the result matches pandasql's.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_engines --users 100 500 1000 --transactions-per-asset 20
+"""
+import argparse
+import csv
+import statistics
+import threading
+import time
+
+import pandas as pd
+
+from benchmarks.bench_codec import print_table
+from data_utils import flatten_data, preprocess_df_for_sql
+from fact_table import FACT_TABLE, FactTable
+from mock_backend import MockData
+from query_catalog import PREMADE_QUERIES, premade_query
+from query_engine import DEFAULT_ENGINE, engine_names, open_engine
+from query_runner import current_rss_bytes
+from table_store import StoreView, TableStore
+
+SAMPLE_INTERVAL_SECONDS = 0.002
+
+
+# Samples the process's resident memory in a background thread and keeps the peak
+class PeakMemory:
+    def __init__(self):
+        self.baseline = current_rss_bytes() or 0
+        self.peak = self.baseline
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss_bytes() or 0)
+            time.sleep(SAMPLE_INTERVAL_SECONDS)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss_bytes() or 0)
+
+    @property
+    def peak_mb(self):
+        return (self.peak - self.baseline) / (1024 * 1024)
+
+
+# Function to build the app's loaded tables for a synthetic dataset of `users` users
+def build_tables(users, transactions_per_asset):
+    data = MockData(users=users, transactions_per_asset=transactions_per_asset)
+    portfolio_ids = range(1, users * data.portfolios_per_user + 1)
+    asset_ids = range(1, len(portfolio_ids) * data.assets_per_portfolio + 1)
+    # A budget large enough that no table is spilled to disk while building
+    store = TableStore(budget_mb=1024 * 1024)
+    facts = FactTable()
+    records = {
+        "users": [data.user(user_id) for user_id in range(1, users + 1)],
+        "portfolios": [p for user_id in range(1, users + 1) for p in data.portfolios_for_user(user_id)],
+        "assets": [a for portfolio_id in portfolio_ids for a in data.assets_for_portfolio(portfolio_id)],
+        "transactions": [t for asset_id in asset_ids for t in data.transactions_for_asset(asset_id)],
+    }
+    for name, rows in records.items():
+        store.put(name, pd.DataFrame(flatten_data(rows)))
+        facts.update(store, name)
+    return StoreView(store, [*records, FACT_TABLE], prepare=preprocess_df_for_sql)
+
+
+# Function to put a result in a canonical form, so results of different engines compare equal
+# regardless of row order and column dtypes
+def canonical(df):
+    df = df.reset_index(drop=True).copy()
+    for col in df.columns:
+        numeric = pd.to_numeric(df[col], errors="coerce")
+        df[col] = numeric.round(6) if numeric.notna().sum() == df[col].notna().sum() else df[col].astype(str)
+    return df.sort_values(list(df.columns), ignore_index=True)
+
+
+def same_result(result, expected):
+    if result is None or expected is None or list(result.columns) != list(expected.columns):
+        return False
+    try:
+        pd.testing.assert_frame_equal(canonical(result), canonical(expected), check_dtype=False)
+        return True
+    except AssertionError:
+        return False
+
+
+# Function to run one query on a fresh engine. Returns (seconds, peak MB, result, error).
+def run_query(engine_name, query, tables):
+    start = time.perf_counter()
+    with PeakMemory() as memory:
+        engine = open_engine(engine_name)
+        try:
+            result = engine.register_for(query, tables).execute(query)
+            error = None
+        except Exception as e:
+            result = None
+            error = f"{type(e).__name__}: {str(e).splitlines()[0][:60]}"
+        finally:
+            engine.close()
+    return time.perf_counter() - start, memory.peak_mb, result, error
+
+
+# Function to benchmark every pre-made query on every engine for one dataset
+def run_dataset(users, tables, engines, repeats):
+    rows = []
+    for query_name, premade in PREMADE_QUERIES.items():
+        expected = None
+        for engine_name in engines:
+            timings = []
+            peaks = []
+            query = premade_query(premade, engine_name)
+            for _ in range(repeats):
+                seconds, peak_mb, result, error = run_query(engine_name, query, tables)
+                timings.append(seconds)
+                peaks.append(peak_mb)
+            if engine_name == DEFAULT_ENGINE:
+                expected = result
+            rows.append({
+                "users": users,
+                "query": query_name,
+                "engine": engine_name,
+                "median_ms": round(statistics.median(timings) * 1000, 1),
+                "peak_mb": round(max(peaks), 1),
+                "rows": len(result) if result is not None else "",
+                "matches_pandasql": "" if engine_name == DEFAULT_ENGINE else (
+                    "error" if error else same_result(result, expected)
+                ),
+                "error": error or "",
+            })
+    return rows
+
+
+# Function to total the catalog's latency and the largest peak memory per engine
+def summarize(rows):
+    totals = {}
+    for row in rows:
+        key = (row["users"], row["engine"])
+        total = totals.setdefault(key, {"users": row["users"], "engine": row["engine"], "catalog_ms": 0.0,
+                                        "max_peak_mb": 0.0, "errors": 0, "mismatches": 0})
+        total["catalog_ms"] = round(total["catalog_ms"] + row["median_ms"], 1)
+        total["max_peak_mb"] = max(total["max_peak_mb"], row["peak_mb"])
+        total["errors"] += bool(row["error"])
+        total["mismatches"] += row["matches_pandasql"] is False
+    return list(totals.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[100, 500, 1000],
+                        help="Dataset sizes, in users (each has 2 portfolios of 5 assets)")
+    parser.add_argument("--transactions-per-asset", type=int, default=20)
+    parser.add_argument("--engines", nargs="+", default=engine_names(), choices=engine_names())
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--csv", help="Also write the per-query results to this CSV file")
+    args = parser.parse_args()
+    # Results are compared with pandasql's, so it always runs first
+    engines = [DEFAULT_ENGINE] + [name for name in args.engines if name != DEFAULT_ENGINE]
+
+    all_rows = []
+    for users in args.users:
+        start = time.perf_counter()
+        tables = build_tables(users, args.transactions_per_asset)
+        # Prepare every table up front, so the first engine is not charged for it
+        sizes = {name: len(tables[name]) for name in tables}
+        print(f"Dataset with {users} users: {sizes} (built in {time.perf_counter() - start:.1f}s)")
+        rows = run_dataset(users, tables, engines, args.repeats)
+        print_table([{k: v for k, v in row.items() if k != "users"} for row in rows])
+        all_rows.extend(rows)
+
+    print(f"Whole catalog per engine (sum of medians of {args.repeats})")
+    print_table(summarize(all_rows))
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(all_rows[0]))
+            writer.writeheader()
+            writer.writerows(all_rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+"""Load-test the Streamlit app with many concurrent simulated sessions.
+
+Starts a local stand-in for the Portfolio API (mock_backend.py) and, for every session count,
+a fresh `streamlit run main.py` server pointed at it. Each simulated session connects to the
+server's websocket the way a browser does and repeatedly logs in, fetches every data tab and
+runs a pre-made and an ad-hoc SQL query, timing every script rerun. Reports per-interaction
+latency percentiles, throughput, and the server's CPU and memory as the session count grows.
+
+Linux only (server CPU and memory are read from /proc). Run from the repository root:
+
+    python -m benchmarks.load_test --sessions 1 2 4 8 16 --iterations 3
+"""
+import argparse
+import csv
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+from websockets.sync.client import connect
+
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+from benchmarks.bench_codec import print_table
+from mock_backend import MockBackend
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Widget types the simulated browser can set, with the WidgetState field holding their value
+WIDGET_VALUE_FIELDS = {
+    "button": "trigger_value",
+    "text_input": "string_value",
+    "text_area": "string_value",
+    "number_input": "double_value",
+    "selectbox": "string_value",
+    "radio": "string_value",
+    "checkbox": "bool_value",
+}
+
+ADHOC_QUERY = (
+    "SELECT transaction_type, COUNT(*) AS trades, AVG(quantity) AS average_quantity "
+    "FROM transactions GROUP BY transaction_type"
+)
+
+SERVER_START_TIMEOUT_SECONDS = 60
+SAMPLE_INTERVAL_SECONDS = 0.5
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+# Function to find a free local port
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# Function to read the CPU seconds and resident memory of a process, or None once it has exited
+def process_usage(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/statm") as f:
+            rss_pages = int(f.read().split()[1])
+    except (FileNotFoundError, ProcessLookupError, IndexError):
+        return None
+    # utime and stime are fields 14 and 15 of /proc/<pid>/stat
+    cpu_seconds = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    return {"ppid": int(fields[1]), "cpu_seconds": cpu_seconds, "rss_bytes": rss_pages * PAGE_SIZE}
+
+
+# Function to get the ids of every descendant of a process, e.g. query worker processes
+def descendants(pid):
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            usage = process_usage(int(entry))
+            if usage:
+                parents.setdefault(usage["ppid"], []).append(int(entry))
+    found, pending = [], [pid]
+    while pending:
+        children = parents.get(pending.pop(), [])
+        found.extend(children)
+        pending.extend(children)
+    return found
+
+
+# Samples the CPU time and memory of the server process and its worker processes in the background
+class ResourceMonitor:
+    def __init__(self, pid):
+        self.pid = pid
+        self.peak_rss = 0
+        self.peak_worker_rss = 0
+        self._start_cpu = None
+        self._end_cpu = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        usage = process_usage(self.pid)
+        if usage is None:
+            return
+        self.peak_rss = max(self.peak_rss, usage["rss_bytes"])
+        workers = [process_usage(child) for child in descendants(self.pid)]
+        self.peak_worker_rss = max(self.peak_worker_rss, sum(w["rss_bytes"] for w in workers if w))
+        return usage["cpu_seconds"]
+
+    def _run(self):
+        while not self._stop.wait(SAMPLE_INTERVAL_SECONDS):
+            cpu = self._sample()
+            if cpu is not None:
+                self._end_cpu = cpu
+
+    def start(self):
+        self._start_cpu = self._end_cpu = self._sample()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        cpu = self._sample()
+        if cpu is not None:
+            self._end_cpu = cpu
+
+    def cpu_seconds(self):
+        return (self._end_cpu or 0) - (self._start_cpu or 0)
+
+
+# A `streamlit run main.py` server in a subprocess, talking to the given API base URL
+class AppServer:
+    def __init__(self, api_url):
+        self.port = free_port()
+        self.api_url = api_url
+        self.process = None
+
+    @property
+    def stream_url(self):
+        return f"ws://127.0.0.1:{self.port}/_stcore/stream"
+
+    def start(self):
+        env = dict(os.environ, PORTFOLIO_API_URL=self.api_url)
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "streamlit", "run", "main.py",
+             "--server.headless", "true", "--server.port", str(self.port),
+             "--server.fileWatcherType", "none", "--browser.gatherUsageStats", "false"],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + SERVER_START_TIMEOUT_SECONDS
+        while time.monotonic() < deadline:
+            try:
+                if requests.get(f"http://127.0.0.1:{self.port}/_stcore/health", timeout=1).ok:
+                    return self
+            except requests.ConnectionError:
+                pass
+            if self.process.poll() is not None:
+                break
+            time.sleep(0.2)
+        self.stop()
+        raise RuntimeError("The Streamlit server did not start")
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# Simulated browser session on an open websocket: reruns the script with widget values,
+# like the Streamlit frontend
+class AppSession:
+    def __init__(self, ws):
+        self.ws = ws
+        self.widgets = {}
+        self.values = {}
+        self.errors = 0
+
+    # Function to rerun the script after setting widgets by label and optionally clicking a button.
+    # Returns the rerun's duration in seconds.
+    def rerun(self, values=None, button=None):
+        for label, value in (values or {}).items():
+            widget_id, kind = self.widgets[label]
+            state = WidgetState(id=widget_id)
+            setattr(state, WIDGET_VALUE_FIELDS[kind], value)
+            self.values[widget_id] = state
+        states = list(self.values.values())
+        if button:
+            widget_id, _ = self.widgets[button]
+            states.append(WidgetState(id=widget_id, trigger_value=True))
+
+        msg = BackMsg()
+        msg.rerun_script.widget_states.widgets.extend(states)
+        start = time.perf_counter()
+        self.ws.send(msg.SerializeToString())
+        while True:
+            forward = ForwardMsg()
+            forward.ParseFromString(self.ws.recv())
+            kind = forward.WhichOneof("type")
+            if kind == "delta":
+                self._read_delta(forward.delta)
+            elif kind == "script_finished":
+                # Periodic fragment reruns (e.g. the health view) finish on their own
+                if forward.script_finished != ForwardMsg.FINISHED_FRAGMENT_RUN_SUCCESSFULLY:
+                    return time.perf_counter() - start
+
+    def _read_delta(self, delta):
+        if delta.WhichOneof("type") != "new_element":
+            return
+        element = delta.new_element
+        kind = element.WhichOneof("type")
+        if kind == "exception" or (kind == "alert" and element.alert.format == element.alert.ERROR):
+            self.errors += 1
+        elif kind in WIDGET_VALUE_FIELDS:
+            widget = getattr(element, kind)
+            self.widgets[widget.label] = (widget.id, kind)
+
+
+# Function to get the interactions of one iteration of a session: (name, widget values, button)
+def scenario(session_no, iteration, data):
+    user_id = (session_no + iteration) % data.users + 1
+    portfolio_id = (user_id - 1) * data.portfolios_per_user + 1
+    asset_id = (portfolio_id - 1) * data.assets_per_portfolio + 1
+    return [
+        ("fetch_users", {"Page": float(iteration), "Size": 10.0}, "Fetch Users"),
+        ("fetch_portfolios", {"User ID for Portfolio": float(user_id)}, "Fetch Portfolio by User ID"),
+        ("fetch_assets", {"Portfolio ID for Assets": float(portfolio_id)}, "Fetch Assets by Portfolio ID"),
+        ("fetch_transactions", {"Asset ID for Transactions": float(asset_id)}, "Fetch Transactions by Asset ID"),
+        ("premade_query", {"Select Advanced Query Type": "Top 5 Most Traded Assets"},
+         "Run 'Top 5 Most Traded Assets' Query"),
+        ("adhoc_query", {"Enter SQL Query": ADHOC_QUERY}, "Run Advanced SQL Query"),
+    ]
+
+
+# Function to run one simulated analyst and append (interaction, seconds) timings to results
+def run_session(url, session_no, iterations, think_time, data, results, errors):
+    try:
+        with connect(url, subprotocols=["streamlit"], max_size=None, open_timeout=30) as ws:
+            session = AppSession(ws)
+            try:
+                run_scenario(session, session_no, iterations, think_time, data, results)
+            finally:
+                errors.extend(["app error"] * session.errors)
+    except Exception as e:
+        errors.append(f"session {session_no}: {type(e).__name__}: {e}")
+
+
+# Function to run the interactions of one session: load, login, then the scenario `iterations` times
+def run_scenario(session, session_no, iterations, think_time, data, results):
+    results.append(("load", session.rerun()))
+    results.append(("login", session.rerun({"Email": f"analyst{session_no}@example.com", "Password": "secret"},
+                                           "Login")))
+    for iteration in range(iterations):
+        for name, values, button in scenario(session_no, iteration, data):
+            if button not in session.widgets or any(label not in session.widgets for label in values):
+                # Widgets that only appear after another widget changed
+                results.append(("widget_change", session.rerun({k: v for k, v in values.items()
+                                                                if k in session.widgets})))
+            results.append((name, session.rerun(values, button)))
+            if think_time:
+                time.sleep(think_time)
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def latency_summary(durations):
+    durations = sorted(durations)
+    return {
+        "count": len(durations),
+        "p50_ms": round(percentile(durations, 0.50) * 1000, 1),
+        "p90_ms": round(percentile(durations, 0.90) * 1000, 1),
+        "p99_ms": round(percentile(durations, 0.99) * 1000, 1),
+        "max_ms": round(durations[-1] * 1000, 1),
+    }
+
+
+# Function to run a number of concurrent sessions against a fresh server and summarize them
+def run_level(backend, sessions, iterations, think_time):
+    with AppServer(backend.base_url) as server:
+        monitor = ResourceMonitor(server.process.pid).start()
+        results, errors = [], []
+        threads = [
+            threading.Thread(target=run_session,
+                             args=(server.stream_url, n, iterations, think_time, backend.data, results, errors))
+            for n in range(sessions)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - start
+        monitor.stop()
+
+    by_interaction = {}
+    for name, seconds in results:
+        by_interaction.setdefault(name, []).append(seconds)
+    interactions = [{"sessions": sessions, "interaction": name, **latency_summary(durations)}
+                    for name, durations in by_interaction.items()]
+    overall = {
+        "sessions": sessions,
+        "interactions": len(results),
+        "errors": len(errors),
+        "throughput_per_s": round(len(results) / wall, 2),
+        **{k: v for k, v in latency_summary([s for _, s in results]).items() if k != "count"},
+        "server_cpu_pct": round(100 * monitor.cpu_seconds() / wall, 1),
+        "server_peak_rss_mb": round(monitor.peak_rss / 2 ** 20, 1),
+        "workers_peak_rss_mb": round(monitor.peak_worker_rss / 2 ** 20, 1),
+    }
+    return overall, interactions, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="Numbers of concurrent sessions to test, one server per number")
+    parser.add_argument("--iterations", type=int, default=2, help="Scenario repetitions per session")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Pause between interactions, in seconds")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--transactions-per-asset", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.0, help="Added mock API delay per request, in seconds")
+    parser.add_argument("--csv", help="Also write the per-interaction results to this CSV file")
+    args = parser.parse_args()
+
+    summary, details = [], []
+    with MockBackend(latency=args.latency, users=args.users,
+                     transactions_per_asset=args.transactions_per_asset) as backend:
+        for sessions in args.sessions:
+            print(f"Running {sessions} concurrent session(s)...", flush=True)
+            overall, interactions, errors = run_level(backend, sessions, args.iterations, args.think_time)
+            summary.append(overall)
+            details.extend(interactions)
+            for error in sorted(set(errors) - {"app error"}):
+                print(f"  {error}")
+
+    print("\nPer interaction")
+    print_table(details)
+    print("Overall")
+    print_table(summary)
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(details[0]))
+            writer.writeheader()
+            writer.writerows(details)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the standard library is used without it
+    orjson = None
+
+try:
+    import brotli  # noqa: F401  (lets urllib3 decode brotli responses)
+    HAS_BROTLI = True
+except ImportError:
+    try:
+        import brotlicffi  # noqa: F401
+        HAS_BROTLI = True
+    except ImportError:
+        HAS_BROTLI = False
+
+# Compressed encodings requests/urllib3 can decode in this environment, best first
+ACCEPT_ENCODING = "br, gzip, deflate" if HAS_BROTLI else "gzip, deflate"
+
+
+# JSON codec using the standard library. Output is compact so every codec produces the same text.
+class StdlibCodec:
+    name = "json"
+
+    def dumps(self, obj):
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, default=str).encode("utf-8")
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+# JSON codec using orjson, which is several times faster on large payloads
+class OrjsonCodec:
+    name = "orjson"
+
+    def dumps(self, obj):
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+# Registered codecs by name. Other implementations can be added with register_codec().
+CODECS = {"json": StdlibCodec()}
+if orjson is not None:
+    CODECS["orjson"] = OrjsonCodec()
+
+# The codec used by dumps()/loads(): the fastest one installed
+_default_codec = CODECS.get("orjson", CODECS["json"])
+
+
+# Function to add a codec. It needs a name and dumps(obj) -> bytes / loads(bytes) -> obj methods.
+def register_codec(codec):
+    CODECS[codec.name] = codec
+
+
+# Function to choose the codec used by dumps()/loads()
+def set_default_codec(name):
+    global _default_codec
+    _default_codec = CODECS[name]
+
+
+def get_codec(name=None):
+    return CODECS[name] if name else _default_codec
+
+
+# Function to serialize an object to JSON bytes, e.g. for a request body
+def dumps(obj):
+    return _default_codec.dumps(obj)
+
+
+# Function to serialize an object to a JSON string, e.g. for a nested list stored in a DataFrame cell
+def dumps_str(obj):
+    return _default_codec.dumps(obj).decode("utf-8")
+
+
+# Function to parse JSON bytes or text
+def loads(data):
+    return _default_codec.loads(data)
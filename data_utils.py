@@ -0,0 +1,54 @@
+import re
+from functools import lru_cache
+
+from codec import dumps_str
+
+
+# Function to convert camelCase or PascalCase to snake_case.
+# API payloads repeat the same few keys on every record, so conversions are cached.
+@lru_cache(maxsize=1024)
+def camel_to_snake(name):
+    s1 = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', name)
+    return re.sub('([a-z0-9])([A-Z])', r'\1_\2', s1).lower()
+
+
+# Function to flatten nested objects and convert keys to snake_case.
+# Nested lists (and objects nested more than one level deep) are serialized to JSON strings
+# here, once, so preprocess_df_for_sql does not have to serialize them again.
+def flatten_data(data):
+    flattened_data = []
+    for item in data:
+        flattened_item = {}
+        for key, value in item.items():
+            # Convert key to snake_case
+            snake_key = camel_to_snake(key)
+            if isinstance(value, dict):
+                for sub_key, sub_value in value.items():
+                    # Convert sub_key to snake_case
+                    snake_sub_key = camel_to_snake(sub_key)
+                    if isinstance(sub_value, (list, dict)):
+                        sub_value = dumps_str(sub_value)
+                    flattened_item[f"{snake_key}_{snake_sub_key}"] = sub_value
+            elif isinstance(value, list):
+                # Convert lists to JSON strings or handle accordingly
+                flattened_item[snake_key] = dumps_str(value)
+            else:
+                flattened_item[snake_key] = value
+        flattened_data.append(flattened_item)
+    return flattened_data
+
+
+# Function to preprocess DataFrame for SQL querying
+def preprocess_df_for_sql(df):
+    # Serialize lists and dicts, which SQLite cannot store. Only object columns can hold them,
+    # and tables built with flatten_data normally have none left, in which case no copy is made.
+    nested_columns = [
+        col for col in df.columns
+        if df[col].dtype == object and df[col].map(lambda x: isinstance(x, (list, dict))).any()
+    ]
+    if not nested_columns:
+        return df
+    df = df.copy()
+    for col in nested_columns:
+        df[col] = df[col].map(lambda x: dumps_str(x) if isinstance(x, (list, dict)) else x)
+    return df
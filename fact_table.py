@@ -0,0 +1,223 @@
+import pandas as pd
+
+# Name of the wide table in SQL queries
+FACT_TABLE = "transaction_facts"
+
+# Source tables, from child to parent, with the prefix their columns get in the fact table
+SOURCE_TABLES = {"transactions": "transaction", "assets": "asset", "portfolios": "portfolio", "users": "user"}
+
+# Column of each source table that references its parent table
+PARENT_KEYS = {"transactions": "asset_id", "assets": "portfolio_id", "portfolios": "user_id", "users": None}
+
+# Columns holding JSON copies of child records, which the fact table already has as rows
+NESTED_CHILD_COLUMNS = {"users": "portfolios", "portfolios": "assets", "assets": "transactions"}
+
+# Key columns of the fact table: the id of the row's transaction, asset, portfolio and user
+# (NULL when that record is not loaded), plus the foreign keys that link them
+KEY_COLUMNS = ["transaction_id", "asset_id", "portfolio_id", "user_id",
+               "transaction_asset_id", "asset_portfolio_id", "portfolio_user_id"]
+
+
+# Function to rename a source table's columns for the fact table: "id" becomes "asset_id",
+# "quantity" becomes "asset_quantity", while "asset_type" stays "asset_type"
+def prefixed(df, table):
+    prefix = SOURCE_TABLES[table]
+    nested = NESTED_CHILD_COLUMNS.get(table)
+    df = df.drop(columns=[nested]) if nested in df.columns else df
+    df = df.rename(columns={col: col if col.startswith(f"{prefix}_") else f"{prefix}_{col}" for col in df.columns})
+    for col in [f"{prefix}_id", f"{prefix}_{PARENT_KEYS[table]}" if PARENT_KEYS[table] else None]:
+        if col is None:
+            continue
+        if col not in df.columns:
+            df[col] = pd.NA
+        df[col] = pd.to_numeric(df[col], errors="coerce").astype("Int64")
+    # Nullable integers, so integer columns stay integers on rows where the record is missing
+    df = df.astype({col: "Int64" for col in df.columns if df[col].dtype.kind in "iu"})
+    # Records without an id cannot be linked to anything
+    return df[df[f"{prefix}_id"].notna()].drop_duplicates(subset=f"{prefix}_id", keep="last")
+
+
+# Function to hash every row of a source table, indexed by id
+def row_hashes(df):
+    if df.empty or "id" not in df.columns:
+        return pd.Series(dtype="uint64")
+    try:
+        hashes = pd.util.hash_pandas_object(df, index=False)
+    except TypeError:
+        # Unhashable cell values such as lists
+        hashes = pd.util.hash_pandas_object(df.astype(str), index=False)
+    hashes.index = pd.to_numeric(df["id"], errors="coerce")
+    hashes = hashes[hashes.index.notna()]
+    return hashes[~hashes.index.duplicated(keep="last")]
+
+
+# Function to get the parent id of every row of a source table, indexed by id
+def parent_ids(df, table):
+    key = PARENT_KEYS[table]
+    if key is None or df.empty or "id" not in df.columns or key not in df.columns:
+        return pd.Series(dtype="float64")
+    parents = pd.Series(pd.to_numeric(df[key], errors="coerce").values, index=pd.to_numeric(df["id"], errors="coerce"))
+    return parents[parents.index.notna()]
+
+
+# Function to get the numeric ids in one column of a source table
+def column_ids(df, column):
+    if df.empty or column not in df.columns:
+        return pd.Series(dtype="float64")
+    return pd.to_numeric(df[column], errors="coerce")
+
+
+# Function to select the rows of a source table whose `column` is in `ids`, prefixed for the fact table
+def select(df, table, ids, column="id"):
+    if df.empty:
+        return prefixed(df, table)
+    return prefixed(df[column_ids(df, column).isin(ids).to_numpy()] if column in df.columns else df.iloc[:0], table)
+
+
+# Function to build fact rows from the raw source tables: the rows of the given transactions,
+# plus the "no children" rows of the given assets, portfolios and users. Only the records
+# these rows need are prefixed and joined, so rebuilding a few rows does not merge whole tables.
+def build_rows(sources, transaction_ids, asset_ids, portfolio_ids, user_ids):
+    transactions = select(sources["transactions"], "transactions", transaction_ids)
+    assets = select(sources["assets"], "assets", set(asset_ids) | set(transactions["transaction_asset_id"].dropna()))
+    portfolios = select(sources["portfolios"], "portfolios",
+                        set(portfolio_ids) | set(assets["asset_portfolio_id"].dropna()))
+    users = select(sources["users"], "users", set(user_ids) | set(portfolios["portfolio_user_id"].dropna()))
+    portfolio_users = portfolios.merge(users, how="left", left_on="portfolio_user_id", right_on="user_id")
+    asset_chain = assets.merge(portfolio_users, how="left", left_on="asset_portfolio_id", right_on="portfolio_id")
+
+    parts = [
+        transactions
+        .merge(asset_chain, how="left", left_on="transaction_asset_id", right_on="asset_id")
+        .assign(grain="transaction")
+    ]
+    # Assets without transactions, portfolios without assets and users without portfolios.
+    # Whether a record has children is checked against the whole child table.
+    has_transactions = asset_chain["asset_id"].isin(column_ids(sources["transactions"], "asset_id").dropna())
+    parts.append(asset_chain[asset_chain["asset_id"].isin(asset_ids) & ~has_transactions].assign(grain="asset"))
+    has_assets = portfolio_users["portfolio_id"].isin(column_ids(sources["assets"], "portfolio_id").dropna())
+    parts.append(
+        portfolio_users[portfolio_users["portfolio_id"].isin(portfolio_ids) & ~has_assets].assign(grain="portfolio")
+    )
+    has_portfolios = users["user_id"].isin(column_ids(sources["portfolios"], "user_id").dropna())
+    parts.append(users[users["user_id"].isin(user_ids) & ~has_portfolios].assign(grain="user"))
+
+    # Columns follow the current source tables, so columns of dropped tables disappear
+    leading = ["grain"] + KEY_COLUMNS
+    columns = leading + [col for col in dict.fromkeys([*transactions.columns, *asset_chain.columns])
+                         if col not in leading]
+    parts = [part for part in parts if not part.empty]
+    rows = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+    dtypes = {**asset_chain.dtypes.to_dict(), **transactions.dtypes.to_dict(), **{col: "Int64" for col in KEY_COLUMNS}}
+    return with_columns(rows, columns, dtypes)
+
+
+# Function to reorder a frame's columns, adding missing ones as empty columns of the given dtypes,
+# so appending rows does not turn integer columns into floats
+def with_columns(df, columns, dtypes):
+    missing = [col for col in columns if col not in df.columns]
+    df = df.reindex(columns=columns)
+    return df.astype({col: dtypes[col] for col in missing if col in dtypes})
+
+
+# Function to get the effective asset, portfolio or user key of fact rows: the record's own id
+# when it is loaded, otherwise the foreign key pointing at it
+def effective_key(facts, level):
+    return {
+        "asset": facts["asset_id"].fillna(facts["transaction_asset_id"]),
+        "portfolio": facts["portfolio_id"].fillna(facts["asset_portfolio_id"]),
+        "user": facts["user_id"].fillna(facts["portfolio_user_id"]),
+    }[level]
+
+
+# Denormalized wide table joining every transaction to its asset, portfolio and user once,
+# so reports that would join users -> portfolios -> assets -> transactions scan a single table.
+#
+# Each transaction is one row. Assets without transactions, portfolios without assets and
+# users without portfolios get a row of their own, so every loaded record appears; the
+# grain column says which kind of row it is.
+#
+# The table is kept in the session's TableStore and updated incrementally: when a source
+# table changes, its rows are diffed by hash against the previous version and only the fact
+# rows of changed records, their descendants and their direct parents are rebuilt, joining only
+# the records those rows need.
+class FactTable:
+    def __init__(self):
+        self._hashes = {table: pd.Series(dtype="uint64") for table in SOURCE_TABLES}
+        self._parents = {table: pd.Series(dtype="float64") for table in SOURCE_TABLES}
+
+    # Function to update the fact table after source table `table` changed in `store`
+    def update(self, store, table):
+        sources = {name: store.get(name) for name in SOURCE_TABLES}
+        if FACT_TABLE not in store:
+            self._build_all(store, sources)
+            return
+
+        new_hashes = row_hashes(sources[table])
+        old_hashes = self._hashes[table]
+        common = old_hashes.index.intersection(new_hashes.index)
+        changed = (
+            set(old_hashes.index.difference(new_hashes.index))
+            | set(new_hashes.index.difference(old_hashes.index))
+            | set(common[old_hashes[common].values != new_hashes[common].values])
+        )
+        new_parents = parent_ids(sources[table], table)
+        old_parents = self._parents[table]
+        self._hashes[table] = new_hashes
+        self._parents[table] = new_parents
+        if not changed:
+            return
+
+        changed_ids = {name: set() for name in SOURCE_TABLES}
+        changed_ids[table] = changed
+        # Parents of changed records may gain or lose their "no children" row
+        parents = set(old_parents[old_parents.index.isin(changed)].dropna()) | \
+            set(new_parents[new_parents.index.isin(changed)].dropna())
+
+        # Descendants of changed records carry copies of their columns, so they are rebuilt too
+        portfolios, assets, transactions = sources["portfolios"], sources["assets"], sources["transactions"]
+        portfolio_ids = changed_ids["portfolios"] | set(
+            column_ids(portfolios, "id")[column_ids(portfolios, "user_id").isin(changed_ids["users"])]
+        )
+        asset_ids = changed_ids["assets"] | set(
+            column_ids(assets, "id")[column_ids(assets, "portfolio_id").isin(portfolio_ids)]
+        )
+        transaction_ids = changed_ids["transactions"] | set(
+            column_ids(transactions, "id")[column_ids(transactions, "asset_id").isin(asset_ids)]
+        )
+        parent_level = {"transactions": "assets", "assets": "portfolios", "portfolios": "users"}.get(table)
+        candidates = {"assets": asset_ids, "portfolios": portfolio_ids, "users": set(changed_ids["users"])}
+        if parent_level:
+            candidates[parent_level] = candidates[parent_level] | parents
+        new_rows = build_rows(sources, transaction_ids, candidates["assets"], candidates["portfolios"],
+                              candidates["users"])
+
+        facts = store.get(FACT_TABLE)
+        if not facts.empty:
+            stale = (
+                ((facts["grain"] == "transaction") & facts["transaction_id"].isin(changed_ids["transactions"]))
+                | effective_key(facts, "asset").isin(changed_ids["assets"])
+                | effective_key(facts, "portfolio").isin(changed_ids["portfolios"])
+                | effective_key(facts, "user").isin(changed_ids["users"])
+            )
+            if parent_level:
+                level = SOURCE_TABLES[parent_level]
+                stale |= (facts["grain"] == level) & effective_key(facts, level).isin(parents)
+            if stale.any():
+                facts = facts[~stale]
+            facts = with_columns(facts, new_rows.columns, new_rows.dtypes.to_dict())
+            new_rows = pd.concat([facts, new_rows], ignore_index=True) if not new_rows.empty else facts
+        store.put(FACT_TABLE, new_rows.reset_index(drop=True))
+
+    # Function to build the whole fact table from the current source tables
+    def _build_all(self, store, sources):
+        for name, df in sources.items():
+            self._hashes[name] = row_hashes(df)
+            self._parents[name] = parent_ids(df, name)
+        ids = {name: set(column_ids(df, "id").dropna()) for name, df in sources.items()}
+        store.put(FACT_TABLE, build_rows(sources, ids["transactions"], ids["assets"], ids["portfolios"], ids["users"]))
+
+    # Function to rebuild the whole fact table from the current source tables
+    def rebuild(self, store):
+        store.drop(FACT_TABLE)
+        self.update(store, "transactions")
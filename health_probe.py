@@ -0,0 +1,268 @@
+import bisect
+import os
+import threading
+import time
+from collections import deque
+
+import requests
+
+from api_client import BASE_URL, HEALTH_URL
+from token_manager import TokenManager, login
+
+# Seconds between probe rounds, and the timeout of each probe request
+PROBE_INTERVAL_SECONDS = 5.0
+PROBE_TIMEOUT_SECONDS = 5.0
+
+# Probe results older than this are dropped from the rolling statistics
+WINDOW_SECONDS = 5 * 60
+
+# Upper bounds (ms) of the latency histogram buckets; slower responses fall in a last "inf" bucket
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+# Service level objectives over the rolling window: the share of successful probes, and the
+# 90th percentile latency
+AVAILABILITY_SLO = 0.99
+LATENCY_SLO_MS = 1000.0
+
+# Consecutive failed probe rounds after which the backend counts as down
+DOWN_AFTER_FAILURES = 3
+
+# The prober pauses when no session has read its state for this long
+IDLE_TIMEOUT_SECONDS = 30 * 60
+
+# Account the prober logs in with to probe the authenticated endpoint. Without one, only the
+# health endpoint is probed. User sessions never lend their tokens to the prober.
+PROBE_EMAIL = os.environ.get("PORTFOLIO_PROBE_EMAIL")
+PROBE_PASSWORD = os.environ.get("PORTFOLIO_PROBE_PASSWORD")
+
+# Probe targets: the unauthenticated health endpoint, and a cheap authenticated API endpoint
+# that goes through the same auth and database path as the data loads
+PROBE_TARGETS = {
+    "health": HEALTH_URL,
+    "api": f"{BASE_URL}/users/count",
+}
+
+# Backend states, from best to worst
+HEALTHY, UNKNOWN, DEGRADED, DOWN = "healthy", "unknown", "degraded", "down"
+
+
+# Function to get the value at quantile q of sorted values
+def _quantile(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))] if values else None
+
+
+# Rolling probe results for one target
+class ProbeWindow:
+    def __init__(self, target):
+        self.target = target
+        self.samples = deque()
+        self.last_status = None
+        self.last_error = None
+
+    def add(self, latency_ms, ok, status, error=None):
+        self.samples.append((time.monotonic(), latency_ms, ok))
+        self.last_status = status
+        self.last_error = error
+        self._trim()
+
+    def _trim(self):
+        cutoff = time.monotonic() - WINDOW_SECONDS
+        while self.samples and self.samples[0][0] < cutoff:
+            self.samples.popleft()
+
+    # Function to count the window's successful probes per latency bucket
+    def histogram(self):
+        counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        for _, latency_ms, ok in self.samples:
+            if ok:
+                counts[bisect.bisect_left(LATENCY_BUCKETS_MS, latency_ms)] += 1
+        return counts
+
+    def stats(self):
+        self._trim()
+        latencies = sorted(latency_ms for _, latency_ms, ok in self.samples if ok)
+        probes = len(self.samples)
+        availability = len(latencies) / probes if probes else None
+        p90 = _quantile(latencies, 0.9)
+        return {
+            "target": self.target,
+            "probes": probes,
+            "availability": round(availability, 4) if availability is not None else None,
+            # Share of the window's error budget (1 - AVAILABILITY_SLO) not yet used up
+            "error_budget_left": (
+                round(max(0.0, 1 - (1 - availability) / (1 - AVAILABILITY_SLO)), 3) if availability is not None else None
+            ),
+            "p50_ms": round(_quantile(latencies, 0.5), 1) if latencies else None,
+            "p90_ms": round(p90, 1) if latencies else None,
+            "p99_ms": round(_quantile(latencies, 0.99), 1) if latencies else None,
+            "last_status": self.last_status,
+            "last_error": self.last_error,
+            "meets_slo": (
+                availability is not None and availability >= AVAILABILITY_SLO
+                and (p90 is None or p90 <= LATENCY_SLO_MS)
+            ),
+        }
+
+
+# Background prober sampling the health endpoint and a representative API endpoint, keeping
+# rolling latency histograms and availability for each.
+#
+# Reading the state never makes a request, so the UI can show it on every rerun. Bulk loaders
+# use recommended_workers() and wait_while_down() to back off while the backend is degraded.
+# The authenticated endpoint is probed with the prober's own account, given as an
+# (email, password) pair in `credentials`, and skipped without one.
+class HealthProbe:
+    def __init__(self, targets=None, interval=PROBE_INTERVAL_SECONDS, timeout=PROBE_TIMEOUT_SECONDS,
+                 credentials=None):
+        self.targets = dict(targets or PROBE_TARGETS)
+        self.interval = interval
+        self.timeout = timeout
+        self.windows = {name: ProbeWindow(name) for name in self.targets}
+        self.consecutive_failures = 0
+        self.last_probe = None
+        self.last_read = time.monotonic()
+        self.credentials = credentials
+        self._auth = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._http = requests.Session()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    # Function to ask for a probe round now instead of at the next interval
+    def probe_now(self):
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._lock:
+                idle = time.monotonic() - self.last_read > IDLE_TIMEOUT_SECONDS
+            if not idle:
+                self.probe_once()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    # Function to get the prober's token, logging in with its account when it has no token or
+    # the token can no longer be renewed. Returns None without an account or when the login fails.
+    def _probe_token(self, target):
+        if not self.credentials:
+            return None
+        try:
+            if self._auth is None or self._auth.expired:
+                self._auth = TokenManager(*login(*self.credentials, session=self._http))
+            return self._auth.get()
+        except Exception as e:
+            # A rejected login says nothing about the backend's health
+            with self._lock:
+                self.windows[target].last_error = f"Probe login failed: {e}"
+            self._auth = None
+            return None
+
+    # Function to probe every target once
+    def probe_once(self):
+        round_failed = False
+        for name, url in self.targets.items():
+            headers = {}
+            if name != "health":
+                token = self._probe_token(name)
+                if not token:
+                    continue
+                headers["Authorization"] = f"Bearer {token}"
+            started = time.perf_counter()
+            try:
+                response = self._http.get(url, headers=headers, timeout=self.timeout)
+            except requests.RequestException as e:
+                latency_ms = (time.perf_counter() - started) * 1000
+                with self._lock:
+                    self.windows[name].add(latency_ms, False, None, type(e).__name__)
+                round_failed = True
+                continue
+            latency_ms = (time.perf_counter() - started) * 1000
+            if response.status_code in (401, 403):
+                # An expired or revoked token says nothing about the backend; log in again next round
+                with self._lock:
+                    self.windows[name].last_status = response.status_code
+                self._auth.close()
+                self._auth = None
+                continue
+            ok = response.status_code < 500 and response.status_code != 429
+            with self._lock:
+                self.windows[name].add(latency_ms, ok, response.status_code,
+                                       None if ok else response.text[:200])
+            round_failed = round_failed or not ok
+        with self._lock:
+            self.consecutive_failures = self.consecutive_failures + 1 if round_failed else 0
+            self.last_probe = time.time()
+
+    # Function to get the overall backend state from the rolling statistics
+    def state(self):
+        with self._lock:
+            self.last_read = time.monotonic()
+            if self.consecutive_failures >= DOWN_AFTER_FAILURES:
+                return DOWN
+            stats = [window.stats() for window in self.windows.values() if window.samples]
+        if not stats:
+            return UNKNOWN
+        return HEALTHY if all(s["meets_slo"] for s in stats) else DEGRADED
+
+    # Function to get the number of concurrent requests a bulk loader should use
+    def recommended_workers(self, max_workers):
+        state = self.state()
+        if state == DOWN:
+            return 1
+        if state == DEGRADED:
+            return max(1, max_workers // 4)
+        return max_workers
+
+    # Function to block while the backend is down, for at most `timeout` seconds.
+    # Returns True when the backend is not (or no longer) down.
+    def wait_while_down(self, timeout=60.0):
+        deadline = time.monotonic() + timeout
+        while self.state() == DOWN:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self.probe_now()
+            time.sleep(min(self.interval, remaining))
+        return True
+
+    # Function to describe the prober's state without making any request
+    def snapshot(self):
+        state = self.state()
+        with self._lock:
+            return {
+                "state": state,
+                "last_probe": self.last_probe,
+                "consecutive_failures": self.consecutive_failures,
+                "targets": [window.stats() for window in self.windows.values()],
+                "histograms": {name: window.histogram() for name, window in self.windows.items()},
+            }
+
+
+# The prober is shared by every session on this server, since they all use the same backend
+_probe = None
+_probe_lock = threading.Lock()
+
+
+# Function to get the server's prober, starting it on first use
+def get_probe():
+    global _probe
+    with _probe_lock:
+        if _probe is None:
+            credentials = (PROBE_EMAIL, PROBE_PASSWORD) if PROBE_EMAIL and PROBE_PASSWORD else None
+            _probe = HealthProbe(credentials=credentials).start()
+        return _probe
+
+
+# Function to get the labels of the latency histogram buckets
+def bucket_labels():
+    bounds = [0] + LATENCY_BUCKETS_MS
+    return [f"{low}-{high} ms" for low, high in zip(bounds, bounds[1:])] + [f">{LATENCY_BUCKETS_MS[-1]} ms"]
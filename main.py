@@ -1,104 +1,127 @@
 import streamlit as st
-import requests
-import json
 import pandas as pd
-import pandasql as psql
 import graphviz
-import re
-
-# Set the base URL for your Portfolio API
-BASE_URL = "http://localhost:8080/api"
+import os
+import time
+from textwrap import dedent
+from data_utils import flatten_data, preprocess_df_for_sql
+from api_client import APIError, api_request
+from token_manager import TokenManager, login
+from rate_limiter import limiter_stats
+from health_probe import get_probe, bucket_labels, PROBE_INTERVAL_SECONDS, AVAILABILITY_SLO, LATENCY_SLO_MS, \
+    WINDOW_SECONDS, HEALTHY, DEGRADED, DOWN
+from query_runner import QueryJob, DEFAULT_TIMEOUT_SECONDS, DEFAULT_ROW_LIMIT, DEFAULT_MEMORY_LIMIT_MB
+from query_export import SessionExports, export_formats, MAX_DOWNLOAD_BYTES, MIME_TYPES
+from user_lookup import LOOKUP_KINDS, SESSION_EXPIRES_ERROR, parse_identifiers, bulk_lookup, merge_users
+from table_store import TableStore, StoreView, process_memory_bytes
+from fact_table import FactTable, FACT_TABLE
+from sketches import SketchCatalog, APPROX_ANSWERS, approx_top_k
+from sync_ledger import sync_entity, reset_table, ledger_frame
+from pandasql.sqldf import extract_table_names
+from query_engine import DEFAULT_ENGINE, engine_names, open_engine
+from query_catalog import PREMADE_QUERIES, premade_query
+from query_log import run_logged_query, SlowQueryLog, DEFAULT_SLOW_QUERY_THRESHOLD_SECONDS
 
 # Initialize session state
-if 'jwt_token' not in st.session_state:
-    st.session_state.jwt_token = None
-if "df_users" not in st.session_state:
-    st.session_state.df_users = pd.DataFrame()
-if "df_portfolios" not in st.session_state:
-    st.session_state.df_portfolios = pd.DataFrame()
-if "df_assets" not in st.session_state:
-    st.session_state.df_assets = pd.DataFrame()
-if "df_transactions" not in st.session_state:
-    st.session_state.df_transactions = pd.DataFrame()
-
-# Function to convert camelCase or PascalCase to snake_case
-def camel_to_snake(name):
-    s1 = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', name)
-    return re.sub('([a-z0-9])([A-Z])', r'\1_\2', s1).lower()
-
-# Function to flatten nested objects and convert keys to snake_case
-def flatten_data(data):
-    flattened_data = []
-    for item in data:
-        flattened_item = {}
-        for key, value in item.items():
-            # Convert key to snake_case
-            snake_key = camel_to_snake(key)
-            if isinstance(value, dict):
-                for sub_key, sub_value in value.items():
-                    # Convert sub_key to snake_case
-                    snake_sub_key = camel_to_snake(sub_key)
-                    flattened_item[f"{snake_key}_{snake_sub_key}"] = sub_value
-            elif isinstance(value, list):
-                # Convert lists to JSON strings or handle accordingly
-                flattened_item[snake_key] = json.dumps(value)
-            else:
-                flattened_item[snake_key] = value
-        flattened_data.append(flattened_item)
-    return flattened_data
-
-# Function to preprocess DataFrame for SQL querying
-def preprocess_df_for_sql(df):
-    # Remove columns with unsupported data types
-    df = df.copy()
-    for col in df.columns:
-        if df[col].apply(lambda x: isinstance(x, (list, dict))).any():
-            df[col] = df[col].apply(lambda x: json.dumps(x) if isinstance(x, (list, dict)) else x)
-    return df
+# The logged-in session's TokenManager, which keeps its JWT valid
+if 'auth' not in st.session_state:
+    st.session_state.auth = None
+# Loaded tables and cached query results live in a store with a memory budget;
+# tables that have not been used recently are spilled to disk
+if "tables" not in st.session_state:
+    st.session_state.tables = TableStore()
+tables = st.session_state.tables
+if "sql_job" not in st.session_state:
+    st.session_state.sql_job = None
+if "last_export" not in st.session_state:
+    st.session_state.last_export = None
+# Export files of this session, deleted when the session ends
+if "exports" not in st.session_state:
+    st.session_state.exports = SessionExports()
+if "sync_ledger" not in st.session_state:
+    st.session_state.sync_ledger = {}
+# Wide table joining every transaction to its asset, portfolio and user, kept up to date as tables load
+if "facts" not in st.session_state:
+    st.session_state.facts = FactTable()
+# Sketches and samples of the loaded tables, for approximate answers
+if "sketches" not in st.session_state:
+    st.session_state.sketches = SketchCatalog()
+# Slow queries of this session; other sessions cannot see or clear them
+if "slow_query_log" not in st.session_state:
+    st.session_state.slow_query_log = SlowQueryLog()
+
+# Function to update the fact table after a loaded table changed. Sketches are only marked
+# out of date here and refreshed when approximate mode is used.
+def refresh_derived(name):
+    st.session_state.facts.update(tables, name)
+    st.session_state.sketches.mark_changed(name)
+    st.session_state.sketches.mark_changed(FACT_TABLE)
+
+# Function to store a loaded table and update the tables derived from it
+def store_table(name, df):
+    tables.put(name, df)
+    refresh_derived(name)
+
+# Function to remove a loaded table and update the tables derived from it
+def drop_table(name):
+    tables.drop(name)
+    refresh_derived(name)
+
+# Function to describe the result of a delta sync
+def describe_sync(entity, entity_id, summary):
+    if summary["status"] == "unchanged":
+        return f"{entity} {entity_id}: no changes since the last sync ({summary['rows_total']} rows)."
+    if summary["status"] == "appended":
+        return f"{entity} {entity_id}: merged {summary['rows_merged']} new rows ({summary['rows_total']} rows in total)."
+    return f"{entity} {entity_id}: loaded {summary['rows_merged']} rows."
 
 # Helper function to make API requests with JWT authentication
 def make_request(endpoint, method='GET', data=None):
-    url = f"{BASE_URL}/{endpoint}"
-    headers = {'Content-Type': 'application/json'}
-    if st.session_state.jwt_token:
-        headers['Authorization'] = f"Bearer {st.session_state.jwt_token}"
-
     try:
-        if method == 'GET':
-            response = requests.get(url, headers=headers)
-        elif method == 'POST':
-            response = requests.post(url, headers=headers, data=json.dumps(data))
-        elif method == 'PUT':
-            response = requests.put(url, headers=headers, data=json.dumps(data))
-        elif method == 'DELETE':
-            response = requests.delete(url, headers=headers)
-        if response.status_code in [200, 201]:
-            return response.json() if response.content else {}
-        else:
-            st.error(f"API Error [{response.status_code}]: {response.text}")
-            return {}
+        return api_request(endpoint, method, data, token=st.session_state.auth)
+    except APIError as e:
+        st.error(str(e))
+        return {}
     except Exception as e:
         st.error(f"Request error: {e}")
         return {}
 
-# Function to authenticate user and obtain JWT token
+# Function to authenticate user and obtain the JWT and refresh token
 def authenticate_user(username, password):
-    url = f"{BASE_URL}/auth/login"
-    headers = {'Content-Type': 'application/json'}
-    data = {'email': username, 'password': password}
-
     try:
-        response = requests.post(url, headers=headers, data=json.dumps(data))
-        if response.status_code == 200:
-            token = response.json().get('token')
-            return token
-        else:
-            st.error(f"Authentication failed: {response.json().get('message', 'Unknown error')}")
-            return None
+        return login(username, password)
+    except APIError as e:
+        st.error(f"Authentication failed: {e.message}")
+        return None
     except Exception as e:
         st.error(f"Error during authentication: {e}")
         return None
 
+# Tables that can be queried in the Advanced SQL Query tab, by their name in SQL
+table_labels = {"users": "Users", "portfolios": "Portfolios", "assets": "Assets", "transactions": "Transactions",
+                FACT_TABLE: "Transaction Facts"}
+
+# Function to run a pre-made query on the chosen query engine and display its result.
+# Slow queries are added to the slow-query log.
+def execute_query(query, locals_dict, source, engine_name=DEFAULT_ENGINE,
+                  threshold=DEFAULT_SLOW_QUERY_THRESHOLD_SECONDS):
+    engine = open_engine(engine_name)
+    try:
+        result_df = run_logged_query(engine, query, locals_dict, source, st.session_state.slow_query_log,
+                                     threshold=threshold)
+        st.dataframe(result_df)
+    except Exception as e:
+        error_message = str(e)
+        if "no such column" in error_message:
+            st.error("Error: One of the specified columns does not exist. Please verify your column names.")
+            # Optionally, display available columns
+            for name in locals_dict:
+                st.write(f"**{table_labels[name]} DataFrame Columns:** {tables.columns(name)}")
+        else:
+            st.error(f"Error: {e}")
+    finally:
+        engine.close()
+
 # Streamlit App
 st.title("Fidelity Interview Prep")
 
@@ -106,18 +129,37 @@ st.title("Fidelity Interview Prep")
 st.sidebar.header("Authentication")
 username = st.sidebar.text_input("Email", value="", type="default")
 password = st.sidebar.text_input("Password", value="", type="password")
-if st.session_state.jwt_token:
+if st.session_state.auth and st.session_state.auth.expired:
+    # The password is not kept, so a session whose token can no longer be renewed logs in again
+    st.session_state.auth.close()
+    st.session_state.auth = None
+    st.sidebar.warning("Your session has expired. Please log in again.")
+if st.session_state.auth:
     if st.sidebar.button("Logout"):
-        st.session_state.jwt_token = None
+        st.session_state.auth.close()
+        st.session_state.auth = None
         st.success("Logged out successfully!")
+    else:
+        expires_at = st.session_state.auth.expires_at
+        if expires_at:
+            st.sidebar.caption(
+                f"Session token valid for {max(0, int(expires_at - time.time())) // 60} more minutes; "
+                + ("it is renewed automatically." if st.session_state.auth.renewable
+                   else "log in again when it expires.")
+            )
 else:
     if st.sidebar.button("Login"):
-        token = authenticate_user(username, password)
-        if token:
-            st.session_state.jwt_token = token
+        credentials = authenticate_user(username, password)
+        if credentials:
+            # Keeps the token valid with the refresh token; the password itself is not kept
+            st.session_state.auth = TokenManager(*credentials)
             st.success("Logged in successfully!")
         else:
-            st.session_state.jwt_token = None
+            st.session_state.auth = None
+
+# Background prober of the API, shared by all sessions on this server. It checks the
+# authenticated endpoint with its own account (PORTFOLIO_PROBE_EMAIL/PORTFOLIO_PROBE_PASSWORD).
+probe = get_probe()
 
 # Tabs for different features
 tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8, tab9 = st.tabs([
@@ -127,7 +169,7 @@ tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8, tab9 = st.tabs([
 # Users Tab
 with tab1:
     st.header("User Management")
-    if st.session_state.jwt_token:
+    if st.session_state.auth:
         page = st.number_input("Page", min_value=0, value=0, step=1)
         size = st.number_input("Size", min_value=1, value=10, step=1)
         sort_by = st.text_input("Sort By", value="id")
@@ -135,24 +177,61 @@ with tab1:
             users = make_request(f"users?page={page}&size={size}&sortBy={sort_by}")
             if 'content' in users:
                 flattened_users = flatten_data(users['content'])
-                st.session_state.df_users = pd.DataFrame(flattened_users)
-                st.dataframe(st.session_state.df_users)
+                store_table("users", pd.DataFrame(flattened_users))
+                st.dataframe(tables.get("users"))
             else:
                 st.error("Failed to fetch users or invalid data format.")
+
+        # Bulk lookup of users by email or account number
+        st.subheader("Bulk Lookup")
+        lookup_kind = st.radio("Look Up By", list(LOOKUP_KINDS), horizontal=True)
+        lookup_text = st.text_area(f"{lookup_kind}s (one per line)", "")
+        if st.button("Look Up Users"):
+            identifiers = parse_identifiers(lookup_text)
+            if identifiers:
+                # Capture the token here: the lookups for misses run in worker threads without session state
+                token = st.session_state.auth
+                # Without a refresh token the lookups must finish before the token expires
+                deadline = None if token.renewable else token.expires_at
+                matches, not_found, errors, fetched_users = bulk_lookup(
+                    tables.get("users"), lookup_kind, identifiers,
+                    lambda endpoint: api_request(endpoint, token=token), flatten_data, probe=probe, deadline=deadline
+                )
+                store_table("users", merge_users(tables.get("users"), fetched_users))
+                local_hits = int((matches["source"] == "local").sum()) if not matches.empty else 0
+                st.info(
+                    f"Found {len(matches)} of {len(identifiers)} users "
+                    f"({local_hits} from loaded data, {len(matches) - local_hits} from the API)."
+                )
+                st.dataframe(matches)
+                if not_found:
+                    st.warning(f"Not found: {', '.join(not_found)}")
+                expiring = [identifier for identifier, error in errors.items() if error == SESSION_EXPIRES_ERROR]
+                if expiring:
+                    st.warning(
+                        f"{len(expiring)} users were not looked up through the API: your session expires before "
+                        "the lookups could finish and the API issued no refresh token to renew it. "
+                        "Log in again and retry, or look up fewer users at a time."
+                    )
+                for identifier, error in errors.items():
+                    if error != SESSION_EXPIRES_ERROR:
+                        st.error(f"{identifier}: {error}")
+            else:
+                st.warning(f"Enter at least one {lookup_kind.lower()}.")
     else:
         st.warning("Please log in to access this section.")
 
 # Portfolios Tab
 with tab2:
     st.header("Portfolio Management")
-    if st.session_state.jwt_token:
+    if st.session_state.auth:
         user_id = st.number_input("User ID for Portfolio", min_value=0, step=1)
         if st.button("Fetch Portfolio by User ID"):
             portfolios = make_request(f"portfolios/user/{user_id}")
             if isinstance(portfolios, list):
                 flattened_portfolios = flatten_data(portfolios)
-                st.session_state.df_portfolios = pd.DataFrame(flattened_portfolios)
-                st.dataframe(st.session_state.df_portfolios)
+                store_table("portfolios", pd.DataFrame(flattened_portfolios))
+                st.dataframe(tables.get("portfolios"))
             else:
                 st.error("Failed to fetch portfolios or invalid data format.")
     else:
@@ -161,58 +240,106 @@ with tab2:
 # Assets Tab
 with tab3:
     st.header("Asset Management")
-    if st.session_state.jwt_token:
+    if st.session_state.auth:
         portfolio_id = st.number_input("Portfolio ID for Assets", min_value=0, step=1)
         if st.button("Fetch Assets by Portfolio ID"):
             assets = make_request(f"assets/portfolio/{portfolio_id}")
             if isinstance(assets, list):
-                flattened_assets = flatten_data(assets)
-                st.session_state.df_assets = pd.DataFrame(flattened_assets)
-                st.dataframe(st.session_state.df_assets)
+                # Only flatten and merge what changed since the last sync of this portfolio
+                df_assets, summary = sync_entity(
+                    st.session_state.sync_ledger, tables.get("assets"), "assets", "portfolio_id",
+                    portfolio_id, assets, flatten_data
+                )
+                if summary["status"] != "unchanged":
+                    store_table("assets", df_assets)
+                st.info(describe_sync("Portfolio", portfolio_id, summary))
+                st.dataframe(df_assets)
             else:
                 st.error("Failed to fetch assets or invalid data format.")
+        if st.button("Clear Loaded Assets"):
+            drop_table("assets")
+            reset_table(st.session_state.sync_ledger, "assets")
     else:
         st.warning("Please log in to access this section.")
 
 # Transactions Tab
 with tab4:
     st.header("Transaction Management")
-    if st.session_state.jwt_token:
+    if st.session_state.auth:
         asset_id = st.number_input("Asset ID for Transactions", min_value=0, step=1)
         if st.button("Fetch Transactions by Asset ID"):
             transactions = make_request(f"transactions/asset/{asset_id}")
             if isinstance(transactions, list):
-                flattened_transactions = flatten_data(transactions)
-                st.session_state.df_transactions = pd.DataFrame(flattened_transactions)
-                st.dataframe(st.session_state.df_transactions)
+                # Only flatten and merge transactions past this asset's watermark
+                df_transactions, summary = sync_entity(
+                    st.session_state.sync_ledger, tables.get("transactions"), "transactions", "asset_id",
+                    asset_id, transactions, flatten_data, date_key="transactionDate"
+                )
+                if summary["status"] != "unchanged":
+                    store_table("transactions", df_transactions)
+                st.info(describe_sync("Asset", asset_id, summary))
+                st.dataframe(df_transactions)
             else:
                 st.error("Failed to fetch transactions or invalid data format.")
+        if st.button("Clear Loaded Transactions"):
+            drop_table("transactions")
+            reset_table(st.session_state.sync_ledger, "transactions")
+        if st.session_state.sync_ledger:
+            with st.expander("Sync Ledger"):
+                st.dataframe(ledger_frame(st.session_state.sync_ledger))
     else:
         st.warning("Please log in to access this section.")
 
 # Health Check Tab
 with tab5:
     st.header("Health Check")
-    if st.session_state.jwt_token:
-        if st.button("Check Health"):
-            url = "http://localhost:8080/health"
-            headers = {'Authorization': f"Bearer {st.session_state.jwt_token}"}
-            try:
-                response = requests.get(url, headers=headers)
-                if response.status_code == 200:
-                    health_status = response.json() if response.content else {"status": "Application is running smoothly!"}
-                    st.json(health_status)
-                else:
-                    st.error(f"Health check failed: {response.text}")
-            except Exception as e:
-                st.error(f"Error: {e}")
+    if st.session_state.auth:
+        # Shows the background prober's rolling statistics. The fragment refreshes on its own
+        # and only reads the prober's state, so it never waits for the API.
+        @st.fragment(run_every=PROBE_INTERVAL_SECONDS)
+        def show_health():
+            snapshot = probe.snapshot()
+            state = snapshot["state"]
+            last_probe = (
+                f"last probe {int(time.time() - snapshot['last_probe'])}s ago" if snapshot["last_probe"] else "no probe yet"
+            )
+            if state == HEALTHY:
+                st.success(f"API healthy ({last_probe}).")
+            elif state == DEGRADED:
+                st.warning(f"API degraded: below its service level objectives ({last_probe}). "
+                           "Bulk lookups run fewer requests at a time.")
+            elif state == DOWN:
+                st.error(f"API down: the last {snapshot['consecutive_failures']} probe rounds failed ({last_probe}). "
+                         "Bulk lookups wait for it to recover.")
+            else:
+                st.info(f"API state unknown ({last_probe}).")
+            st.caption(
+                f"Probes `/health` and `users/count` every {PROBE_INTERVAL_SECONDS:g} seconds. Objectives over the "
+                f"last {WINDOW_SECONDS // 60} minutes: {AVAILABILITY_SLO:.0%} availability, "
+                f"90th percentile latency under {LATENCY_SLO_MS:g} ms."
+            )
+            st.dataframe(pd.DataFrame(snapshot["targets"]))
+            st.markdown("**Latency Histogram** (successful probes per bucket)")
+            st.dataframe(pd.DataFrame(snapshot["histograms"], index=bucket_labels()).T)
+            if st.button("Probe Now"):
+                probe.probe_now()
+
+        show_health()
+
+        # Client-side limiters for API requests, per endpoint family
+        st.subheader("API Rate Limits")
+        limiters = limiter_stats()
+        if limiters:
+            st.dataframe(pd.DataFrame(limiters))
+        else:
+            st.info("No API requests made yet.")
     else:
         st.warning("Please log in to access this section.")
 
 # User Count Tab
 with tab6:
     st.header("User Count")
-    if st.session_state.jwt_token:
+    if st.session_state.auth:
         if st.button("Get User Count"):
             user_count = make_request("users/count")
             if isinstance(user_count, dict) and "count" in user_count:
@@ -226,30 +353,34 @@ with tab6:
 with tab7:
     st.header("Run Advanced SQL Queries on Loaded Data")
 
-    if st.session_state.jwt_token:
-        # Dropdown to select which DataFrames to query
-        df_options = {
-            "Users": st.session_state.df_users,
-            "Portfolios": st.session_state.df_portfolios,
-            "Assets": st.session_state.df_assets,
-            "Transactions": st.session_state.df_transactions
-        }
-
-        # Prepare all DataFrames for SQL querying
-        sql_ready_dfs = {name: preprocess_df_for_sql(df) for name, df in df_options.items()}
+    if st.session_state.auth:
+        # Tables are loaded and prepared for SQL querying only when a query reads them
+        locals_dict = StoreView(tables, list(table_labels), prepare=preprocess_df_for_sql)
 
         # Display available DataFrames
         st.subheader("Available DataFrames")
-        for name, df in df_options.items():
-            if not df.empty:
-                st.write(f"**{name} DataFrame**")
-                st.dataframe(df)
+        if tables.non_empty():
+            st.dataframe(tables.stats())
+            st.caption(
+                f"Memory used by loaded tables: {tables.memory_bytes() / (1024 * 1024):.1f} MB in this session, "
+                f"{process_memory_bytes() / (1024 * 1024):.1f} MB on this server."
+            )
+            if st.checkbox("Show table contents"):
+                for name in locals_dict:
+                    st.write(f"**{table_labels[name]} DataFrame**")
+                    st.dataframe(tables.get(name))
 
         # Debug: Display DataFrame Columns
         st.subheader("Debug: DataFrame Columns")
-        for name, df in df_options.items():
-            if not df.empty:
-                st.write(f"**{name} DataFrame Columns:** {list(df.columns)}")
+        for name in locals_dict:
+            st.write(f"**{table_labels[name]} DataFrame Columns:** {tables.columns(name)}")
+
+        # Engine running the ad-hoc and pre-made queries
+        query_engine = st.selectbox(
+            "Query Engine", engine_names(),
+            help="pandasql copies the tables a query reads into SQLite for every query. sqlite also indexes "
+                 "the id columns. duckdb queries the tables in place but its SQL dialect differs in places."
+        )
 
         # Advanced SQL Query Input
         st.subheader("Write Your Advanced SQL Query")
@@ -259,6 +390,10 @@ with tab7:
         - **Portfolios** (`portfolios`)
         - **Assets** (`assets`)
         - **Transactions** (`transactions`)
+        - **Transaction Facts** (`transaction_facts`): every transaction joined to its asset, portfolio and user.
+          Columns carry the prefix of their table (`transaction_quantity`, `asset_symbol`, `user_name`, ...).
+          Assets without transactions, portfolios without assets and users without portfolios get a row of
+          their own, marked by the `grain` column.
 
         **Example Query with Subquery:**
         ```sql
@@ -273,320 +408,171 @@ with tab7:
         """)
         query = st.text_area("Enter SQL Query", "SELECT * FROM users WHERE id > 10 LIMIT 10;")
 
-        if st.button("Run Advanced SQL Query"):
-            try:
-                # Build the locals dictionary for pandasql
-                locals_dict = {name.lower(): df for name, df in sql_ready_dfs.items() if not df.empty}
-                result_df = psql.sqldf(query, locals_dict)
-                st.dataframe(result_df)
-            except Exception as e:
+        # Limits for ad-hoc queries, which run in a separate worker process
+        with st.expander("Query Limits"):
+            query_timeout = st.number_input("Timeout (seconds)", min_value=1, value=DEFAULT_TIMEOUT_SECONDS, step=1)
+            row_limit = st.number_input("Row Limit", min_value=1, value=DEFAULT_ROW_LIMIT, step=1000)
+            memory_limit_mb = st.number_input(
+                "Memory Limit (MB)", min_value=64, value=DEFAULT_MEMORY_LIMIT_MB, step=64,
+                help="Memory the query may use on top of the worker's starting size, which already holds the "
+                     "query libraries and the tables it reads."
+            )
+            slow_query_threshold = st.number_input(
+                "Slow Query Threshold (seconds)", min_value=0.0, value=DEFAULT_SLOW_QUERY_THRESHOLD_SECONDS, step=0.5
+            )
+
+        run_col, cancel_col = st.columns(2)
+        run_clicked = run_col.button("Run Advanced SQL Query")
+        cancel_clicked = cancel_col.button("Cancel Query")
+
+        # Streaming export of the full query result, written in chunks straight to a file
+        export_col, export_button_col = st.columns(2)
+        export_format = export_col.selectbox("Export Format", export_formats())
+        export_clicked = export_button_col.button("Export Full Result")
+
+        if cancel_clicked and st.session_state.sql_job is not None:
+            st.session_state.sql_job.cancel()
+            st.session_state.sql_job = None
+            st.warning("Query cancelled.")
+
+        if run_clicked or export_clicked:
+            # Only one ad-hoc query per session at a time
+            if st.session_state.sql_job is not None:
+                st.session_state.sql_job.cancel()
+            # Only the tables the query reads are sent to the worker process
+            query_tables = {name: locals_dict[name] for name in extract_table_names(query) if name in locals_dict}
+            st.session_state.sql_job = QueryJob(
+                query, query_tables, timeout=query_timeout, row_limit=row_limit, memory_limit_mb=memory_limit_mb,
+                slow_query_threshold=slow_query_threshold,
+                export_path=st.session_state.exports.new_path(export_format) if export_clicked else None,
+                export_format=export_format, engine=query_engine, slow_query_log=st.session_state.slow_query_log
+            )
+
+        # Wait for the running query. Updating the status on every poll lets Streamlit
+        # interrupt the wait when the Cancel button is clicked.
+        job = st.session_state.sql_job
+        if job is not None:
+            status = st.empty()
+            while not job.poll():
+                status.info(f"Running query... {job.elapsed():.1f}s elapsed")
+            status.empty()
+            st.session_state.sql_job = None
+            if job.error is None and job.export_path:
+                # Keep only the latest export of this session on disk
+                previous_export = st.session_state.last_export
+                if previous_export and os.path.exists(previous_export["path"]):
+                    os.remove(previous_export["path"])
+                st.session_state.last_export = {
+                    "path": job.export_path,
+                    "format": job.export_format,
+                    "rows": job.rows_exported,
+                }
+            elif job.error is None:
+                # Cached results count against the session's memory budget like the tables
+                tables.put("query_result", job.result_df)
+                # The row limit the result was cut at, or None; the Row Limit input may change later
+                st.session_state.query_result_truncated_at = job.row_limit if job.truncated else None
+            else:
+                tables.drop("query_result")
                 # Enhanced error handling
-                error_message = str(e)
-                if "no such column" in error_message:
+                if "no such column" in job.error:
                     st.error("Error: One of the specified columns does not exist. Please verify your column names.")
                     # Optionally, display available columns
-                    for name, df in sql_ready_dfs.items():
-                        st.write(f"**{name.capitalize()} DataFrame Columns:** {list(df.columns)}")
+                    for name in locals_dict:
+                        st.write(f"**{table_labels[name]} DataFrame Columns:** {tables.columns(name)}")
                 else:
-                    st.error(f"Error: {e}")
+                    st.error(f"Error: {job.error}")
+
+        # Show the result of the latest query, which stays on screen across reruns
+        if "query_result" in tables:
+            st.dataframe(tables.get("query_result"))
+            if st.session_state.get("query_result_truncated_at"):
+                st.warning(f"Result truncated to the first {st.session_state.query_result_truncated_at} rows.")
+
+        # Show the latest export of this session
+        last_export = st.session_state.last_export
+        if last_export and os.path.exists(last_export["path"]):
+            export_size = os.path.getsize(last_export["path"])
+            st.success(
+                f"Exported {last_export['rows']} rows ({export_size / (1024 * 1024):.1f} MB) "
+                f"to `{last_export['path']}`."
+            )
+            if export_size <= MAX_DOWNLOAD_BYTES:
+                with open(last_export["path"], "rb") as export_file:
+                    st.download_button(
+                        f"Download {last_export['format']} Export",
+                        export_file,
+                        file_name=os.path.basename(last_export["path"]),
+                        mime=MIME_TYPES[last_export["format"]],
+                    )
+            else:
+                st.info("The export is too large to download through the browser. Copy it from the server path above.")
+
+        # Approximate answers from sketches and samples of the loaded tables
+        st.subheader("Approximate Answers")
+        approximate = st.toggle(
+            "Approximate mode",
+            help="Answer distinct counts, top values, quantiles and averages from sketches and stratified "
+                 "samples instead of scanning the tables. Much faster on large tables, within the bounds shown."
+        )
+        sketches = st.session_state.sketches
+        if approximate:
+            # Sketches of tables loaded or changed since approximate mode was last used
+            with st.spinner("Updating sketches..."):
+                sketches.refresh(tables)
+            if sketches.tables():
+                approx_table = st.selectbox("Table", sketches.tables(), format_func=lambda name: table_labels.get(name, name))
+                sketch = sketches.get(approx_table)
+                approx_column = st.selectbox("Column", list(sketch.columns))
+                approx_kind = st.selectbox("Estimate", list(APPROX_ANSWERS))
+                if st.button("Estimate"):
+                    estimator, bounds_note = APPROX_ANSWERS[approx_kind]
+                    try:
+                        st.dataframe(estimator(sketch, approx_column))
+                        st.caption(f"Summarizes {sketch.rows:,} rows. {bounds_note}")
+                    except ValueError as e:
+                        st.error(f"Error: {e}")
+            else:
+                st.info("Load some data to build sketches.")
 
         # Additional Pre-made Advanced Queries
         st.subheader("Pre-made Advanced SQL Queries")
-        advanced_query_type = st.selectbox("Select Advanced Query Type", [
-            "Users with Most Portfolios",
-            "Assets with Highest Total Value",
-            "Transactions Summary per Asset",
-            "Users with No Portfolios",
-            "Portfolios with No Assets",
-            "Top 5 Most Traded Assets",
-            "Average Asset Value per Portfolio",
-            "Users with Portfolios Exceeding a Total Value",
-            "Assets Purchased in Last 30 Days",
-            "Users by Age Group",
-            "Assets Distribution by Type",
-            "Transactions Above Average Quantity",
-            "Portfolios with Diversified Assets",
-            "Inactive Users (No Transactions)",
-            "Top Performing Assets by Return Rate",
-            "Custom Subquery",
-            "Window Functions Example"
-        ])
-
-        # Function to execute and display query results
-        def execute_query(query, locals_dict):
-            try:
-                result_df = psql.sqldf(query, locals_dict)
-                st.dataframe(result_df)
-            except Exception as e:
-                error_message = str(e)
-                if "no such column" in error_message:
-                    st.error("Error: One of the specified columns does not exist. Please verify your column names.")
-                    # Optionally, display available columns
-                    for name, df in locals_dict.items():
-                        st.write(f"**{name.capitalize()} DataFrame Columns:** {list(df.columns)}")
+        advanced_query_type = st.selectbox("Select Advanced Query Type", list(PREMADE_QUERIES))
+
+        premade = PREMADE_QUERIES[advanced_query_type]
+        if premade.get("show_query"):
+            st.markdown(f"**{advanced_query_type} Example:**\n```sql\n{dedent(premade['query']).strip()}\n```")
+        if all(name in locals_dict for name in premade["requires"]):
+            if st.button(f"Run '{advanced_query_type}' Query"):
+                if advanced_query_type == "Top 5 Most Traded Assets" and approximate and FACT_TABLE in sketches:
+                    # Heavy hitters of the asset symbols of all transactions, without scanning them
+                    top_assets = approx_top_k(sketches.get(FACT_TABLE), "asset_symbol", k=5)
+                    st.dataframe(top_assets.rename(columns={"value": "symbol", "estimated_count": "trade_count"}))
+                    st.caption(f"Approximate. {APPROX_ANSWERS['Top 10 Values'][1]}")
                 else:
-                    st.error(f"Error: {e}")
-
-        locals_dict = {name.lower(): df for name, df in sql_ready_dfs.items() if not df.empty}
-
-        if advanced_query_type == "Users with Most Portfolios":
-            if 'users' in locals_dict and 'portfolios' in locals_dict:
-                if st.button("Run 'Users with Most Portfolios' Query"):
-                    query = """
-                    SELECT u.id, u.name, COUNT(p.id) AS portfolio_count
-                    FROM users u
-                    JOIN portfolios p ON u.id = p.user_id
-                    GROUP BY u.id, u.name
-                    ORDER BY portfolio_count DESC
-                    """
-                    execute_query(query, locals_dict)
-            else:
-                st.warning("Users and Portfolios data must be loaded.")
-
-        elif advanced_query_type == "Assets with Highest Total Value":
-            if 'assets' in locals_dict:
-                if st.button("Run 'Assets with Highest Total Value' Query"):
-                    query = """
-                    SELECT symbol, asset_type, SUM(total_value) AS total_value_sum
-                    FROM assets
-                    GROUP BY symbol, asset_type
-                    ORDER BY total_value_sum DESC
-                    LIMIT 10
-                    """
-                    execute_query(query, locals_dict)
-            else:
-                st.warning("Assets data must be loaded.")
-
-        elif advanced_query_type == "Transactions Summary per Asset":
-            if 'transactions' in locals_dict and 'assets' in locals_dict:
-                if st.button("Run 'Transactions Summary per Asset' Query"):
-                    query = """
-                    SELECT a.symbol, COUNT(t.id) AS transaction_count, SUM(t.quantity) AS total_quantity
-                    FROM transactions t
-                    JOIN assets a ON t.asset_id = a.id
-                    GROUP BY a.symbol
-                    ORDER BY transaction_count DESC
-                    """
-                    execute_query(query, locals_dict)
-            else:
-                st.warning("Assets and Transactions data must be loaded.")
-
-        elif advanced_query_type == "Users with No Portfolios":
-            if 'users' in locals_dict and 'portfolios' in locals_dict:
-                if st.button("Run 'Users with No Portfolios' Query"):
-                    query = """
-                    SELECT u.id, u.name
-                    FROM users u
-                    LEFT JOIN portfolios p ON u.id = p.user_id
-                    WHERE p.id IS NULL
-                    """
-                    execute_query(query, locals_dict)
-            else:
-                st.warning("Users and Portfolios data must be loaded.")
-
-        elif advanced_query_type == "Portfolios with No Assets":
-            if 'portfolios' in locals_dict and 'assets' in locals_dict:
-                if st.button("Run 'Portfolios with No Assets' Query"):
-                    query = """
-                    SELECT p.id, p.portfolio_name
-                    FROM portfolios p
-                    LEFT JOIN assets a ON p.id = a.portfolio_id
-                    WHERE a.id IS NULL
-                    """
-                    execute_query(query, locals_dict)
-            else:
-                st.warning("Portfolios and Assets data must be loaded.")
-
-        elif advanced_query_type == "Top 5 Most Traded Assets":
-            if 'transactions' in locals_dict and 'assets' in locals_dict:
-                if st.button("Run 'Top 5 Most Traded Assets' Query"):
-                    query = """
-                    SELECT a.symbol, COUNT(t.id) AS trade_count
-                    FROM transactions t
-                    JOIN assets a ON t.asset_id = a.id
-                    GROUP BY a.symbol
-                    ORDER BY trade_count DESC
-                    LIMIT 5
-                    """
-                    execute_query(query, locals_dict)
-            else:
-                st.warning("Assets and Transactions data must be loaded.")
-
-        elif advanced_query_type == "Average Asset Value per Portfolio":
-            if 'assets' in locals_dict and 'portfolios' in locals_dict:
-                if st.button("Run 'Average Asset Value per Portfolio' Query"):
-                    query = """
-                    SELECT p.portfolio_name, AVG(a.total_value) AS average_value
-                    FROM assets a
-                    JOIN portfolios p ON a.portfolio_id = p.id
-                    GROUP BY p.portfolio_name
-                    ORDER BY average_value DESC
-                    """
-                    execute_query(query, locals_dict)
-            else:
-                st.warning("Assets and Portfolios data must be loaded.")
-
-        elif advanced_query_type == "Users with Portfolios Exceeding a Total Value":
-            if 'users' in locals_dict and 'portfolios' in locals_dict and 'assets' in locals_dict:
-                if st.button("Run 'Users with Portfolios Exceeding a Total Value' Query"):
-                    query = """
-                    SELECT u.id, u.name, SUM(a.total_value) AS total_portfolio_value
-                    FROM users u
-                    JOIN portfolios p ON u.id = p.user_id
-                    JOIN assets a ON p.id = a.portfolio_id
-                    GROUP BY u.id, u.name
-                    HAVING SUM(a.total_value) > 100000
-                    ORDER BY total_portfolio_value DESC
-                    """
-                    execute_query(query, locals_dict)
-            else:
-                st.warning("Users, Portfolios, and Assets data must be loaded.")
-
-        elif advanced_query_type == "Assets Purchased in Last 30 Days":
-            if 'assets' in locals_dict:
-                if st.button("Run 'Assets Purchased in Last 30 Days' Query"):
-                    query = """
-                    SELECT *
-                    FROM assets
-                    WHERE purchase_date >= DATE('now', '-30 days')
-                    """
-                    execute_query(query, locals_dict)
-            else:
-                st.warning("Assets data must be loaded.")
-
-        elif advanced_query_type == "Users by Age Group":
-            if 'users' in locals_dict:
-                if st.button("Run 'Users by Age Group' Query"):
-                    query = """
-                    SELECT 
-                        CASE 
-                            WHEN date_of_birth <= DATE('now', '-60 years') THEN '60+'
-                            WHEN date_of_birth <= DATE('now', '-50 years') THEN '50-59'
-                            WHEN date_of_birth <= DATE('now', '-40 years') THEN '40-49'
-                            WHEN date_of_birth <= DATE('now', '-30 years') THEN '30-39'
-                            ELSE 'Under 30'
-                        END AS age_group,
-                        COUNT(*) AS user_count
-                    FROM users
-                    GROUP BY age_group
-                    ORDER BY 
-                        CASE age_group
-                            WHEN 'Under 30' THEN 1
-                            WHEN '30-39' THEN 2
-                            WHEN '40-49' THEN 3
-                            WHEN '50-59' THEN 4
-                            WHEN '60+' THEN 5
-                        END
-                    """
-                    execute_query(query, locals_dict)
-            else:
-                st.warning("Users data must be loaded.")
-
-        elif advanced_query_type == "Assets Distribution by Type":
-            if 'assets' in locals_dict:
-                if st.button("Run 'Assets Distribution by Type' Query"):
-                    query = """
-                    SELECT asset_type, COUNT(*) AS asset_count
-                    FROM assets
-                    GROUP BY asset_type
-                    ORDER BY asset_count DESC
-                    """
-                    execute_query(query, locals_dict)
-            else:
-                st.warning("Assets data must be loaded.")
-
-        elif advanced_query_type == "Transactions Above Average Quantity":
-            if 'transactions' in locals_dict:
-                if st.button("Run 'Transactions Above Average Quantity' Query"):
-                    query = """
-                    SELECT *
-                    FROM transactions
-                    WHERE quantity > (SELECT AVG(quantity) FROM transactions)
-                    ORDER BY quantity DESC
-                    """
-                    execute_query(query, locals_dict)
-            else:
-                st.warning("Transactions data must be loaded.")
-
-        elif advanced_query_type == "Portfolios with Diversified Assets":
-            if 'portfolios' in locals_dict and 'assets' in locals_dict:
-                if st.button("Run 'Portfolios with Diversified Assets' Query"):
-                    query = """
-                    SELECT p.portfolio_name, COUNT(DISTINCT a.asset_type) AS asset_type_count
-                    FROM portfolios p
-                    JOIN assets a ON p.id = a.portfolio_id
-                    GROUP BY p.portfolio_name
-                    HAVING COUNT(DISTINCT a.asset_type) >= 3
-                    ORDER BY asset_type_count DESC
-                    """
-                    execute_query(query, locals_dict)
-            else:
-                st.warning("Portfolios and Assets data must be loaded.")
-
-        elif advanced_query_type == "Inactive Users (No Transactions)":
-            if 'users' in locals_dict and 'transactions' in locals_dict:
-                if st.button("Run 'Inactive Users (No Transactions)' Query"):
-                    query = """
-                    SELECT u.id, u.name
-                    FROM users u
-                    LEFT JOIN portfolios p ON u.id = p.user_id
-                    LEFT JOIN assets a ON p.id = a.portfolio_id
-                    LEFT JOIN transactions t ON a.id = t.asset_id
-                    WHERE t.id IS NULL
-                    GROUP BY u.id, u.name
-                    """
-                    execute_query(query, locals_dict)
-            else:
-                st.warning("Users, Portfolios, Assets, and Transactions data must be loaded.")
-
-        elif advanced_query_type == "Top Performing Assets by Return Rate":
-            if 'assets' in locals_dict:
-                if st.button("Run 'Top Performing Assets by Return Rate' Query"):
-                    query = """
-                    SELECT symbol, ((current_price - purchase_price) / purchase_price) * 100 AS return_rate
-                    FROM assets
-                    ORDER BY return_rate DESC
-                    LIMIT 10
-                    """
-                    execute_query(query, locals_dict)
-            else:
-                st.warning("Assets data must be loaded.")
-
-        elif advanced_query_type == "Custom Subquery":
-            st.markdown("""
-            **Custom Subquery Example:**
-            ```sql
-            SELECT u.name, p.portfolio_name
-            FROM users u
-            JOIN portfolios p ON u.id = p.user_id
-            WHERE p.id IN (SELECT portfolio_id FROM assets WHERE asset_type = 'Stock')
-            ```
-            """)
-            if st.button("Run 'Custom Subquery' Query"):
-                query = """
-                SELECT u.name, p.portfolio_name
-                FROM users u
-                JOIN portfolios p ON u.id = p.user_id
-                WHERE p.id IN (SELECT portfolio_id FROM assets WHERE asset_type = 'Stock')
-                """
-                execute_query(query, locals_dict)
-
-        elif advanced_query_type == "Window Functions Example":
-            if 'transactions' in locals_dict:
-                if st.button("Run 'Window Functions Example' Query"):
-                    query = """
-                    SELECT 
-                        t.id, 
-                        t.transaction_type, 
-                        t.quantity, 
-                        t.price_per_unit,
-                        AVG(t.quantity) OVER (PARTITION BY t.transaction_type) AS avg_quantity
-                    FROM transactions t
-                    ORDER BY t.transaction_type
-                    """
-                    execute_query(query, locals_dict)
-            else:
-                st.warning("Transactions data must be loaded.")
+                    execute_query(premade_query(premade, query_engine), locals_dict, advanced_query_type,
+                                  query_engine, slow_query_threshold)
+        else:
+            st.warning(premade["missing"])
+
+        # Slow-query log of this session
+        st.subheader("Slow Query Log")
+        st.caption(f"Queries that took at least {slow_query_threshold} seconds, with their query plans.")
+        slow_query_log = st.session_state.slow_query_log.to_frame()
+        if slow_query_log.empty:
+            st.info("No slow queries recorded yet.")
+        else:
+            st.dataframe(slow_query_log)
+            log_col, clear_col = st.columns(2)
+            log_col.download_button(
+                "Export Slow Query Log (CSV)",
+                slow_query_log.to_csv(index=False),
+                file_name="slow_query_log.csv",
+                mime="text/csv",
+            )
+            if clear_col.button("Clear Slow Query Log"):
+                st.session_state.slow_query_log.clear()
+                st.rerun()
 
     else:
         st.warning("Please log in to access this section.")
@@ -0,0 +1,328 @@
+import argparse
+import base64
+import gzip
+import hashlib
+import hmac
+import json
+import random
+import re
+import secrets
+import threading
+import time
+import zlib
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+try:
+    import brotli
+except ImportError:  # brotli responses are only offered when it is installed
+    brotli = None
+
+# Local stand-in for the Portfolio API, used by the benchmarks and the load-test harness.
+# Data is synthetic and deterministic: the same ids always produce the same records.
+
+ASSET_TYPES = ["Stock", "Bond", "ETF", "Mutual Fund", "Crypto"]
+PORTFOLIO_TYPES = ["Long-term", "Short-term", "Retirement"]
+SYMBOLS = ["AAPL", "MSFT", "GOOG", "AMZN", "TSLA", "VTI", "BND", "SPY", "QQQ", "BTC"]
+
+# Static token accepted without expiry, for benchmarks that skip the login
+TOKEN = "mock-token"
+
+# Key signing the JWTs issued by the login endpoint, and their default lifetime
+TOKEN_SECRET = b"mock-backend-secret"
+DEFAULT_TOKEN_LIFETIME_SECONDS = 3600
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+# Function to issue an HS256 JWT for a user, valid for `lifetime` seconds
+def issue_token(email, lifetime):
+    now = int(time.time())
+    header = _b64(json.dumps({"alg": "HS256", "typ": "JWT"}).encode())
+    payload = _b64(json.dumps({"sub": email, "iat": now, "exp": now + lifetime}).encode())
+    signature = hmac.new(TOKEN_SECRET, f"{header}.{payload}".encode(), hashlib.sha256).digest()
+    return f"{header}.{payload}.{_b64(signature)}"
+
+
+# Function to check a token's signature and expiry
+def token_valid(token):
+    if token == TOKEN:
+        return True
+    try:
+        header, payload, signature = token.split(".")
+        expected = _b64(hmac.new(TOKEN_SECRET, f"{header}.{payload}".encode(), hashlib.sha256).digest())
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return hmac.compare_digest(signature, expected) and claims["exp"] > time.time()
+    except (ValueError, KeyError, TypeError):
+        return False
+
+
+# Synthetic dataset with a fixed number of records at each level
+class MockData:
+    def __init__(self, users=100, portfolios_per_user=2, assets_per_portfolio=5, transactions_per_asset=50):
+        self.users = users
+        self.portfolios_per_user = portfolios_per_user
+        self.assets_per_portfolio = assets_per_portfolio
+        self.transactions_per_asset = transactions_per_asset
+
+    def user(self, user_id, with_portfolios=True):
+        if not 1 <= user_id <= self.users:
+            return None
+        rng = random.Random(user_id)
+        user = {
+            "id": user_id,
+            "name": f"User {user_id}",
+            "email": f"user{user_id}@example.com",
+            "accountNumber": f"ACC{user_id:08d}",
+            "dateOfBirth": (date(1950, 1, 1) + timedelta(days=rng.randrange(20000))).isoformat(),
+            "phoneNumber": f"555-{rng.randrange(10000):04d}",
+            "address": f"{rng.randrange(1, 999)} Main St",
+        }
+        if with_portfolios:
+            user["portfolios"] = [
+                {k: v for k, v in p.items() if k != "assets"} for p in self.portfolios_for_user(user_id)
+            ]
+        return user
+
+    def portfolios_for_user(self, user_id):
+        if not 1 <= user_id <= self.users:
+            return []
+        first = (user_id - 1) * self.portfolios_per_user + 1
+        return [self.portfolio(pid) for pid in range(first, first + self.portfolios_per_user)]
+
+    def portfolio(self, portfolio_id):
+        rng = random.Random(portfolio_id * 7)
+        return {
+            "id": portfolio_id,
+            "portfolioName": f"Portfolio {portfolio_id}",
+            "creationDate": (date(2015, 1, 1) + timedelta(days=rng.randrange(3000))).isoformat(),
+            "portfolioType": rng.choice(PORTFOLIO_TYPES),
+            "userId": (portfolio_id - 1) // self.portfolios_per_user + 1,
+        }
+
+    def assets_for_portfolio(self, portfolio_id):
+        if not 1 <= portfolio_id <= self.users * self.portfolios_per_user:
+            return []
+        first = (portfolio_id - 1) * self.assets_per_portfolio + 1
+        return [self.asset(aid) for aid in range(first, first + self.assets_per_portfolio)]
+
+    def asset(self, asset_id):
+        rng = random.Random(asset_id * 13)
+        quantity = rng.randrange(1, 500)
+        purchase_price = round(rng.uniform(5, 500), 2)
+        current_price = round(purchase_price * rng.uniform(0.5, 2.0), 2)
+        return {
+            "id": asset_id,
+            "symbol": rng.choice(SYMBOLS),
+            "assetType": rng.choice(ASSET_TYPES),
+            "quantity": quantity,
+            "purchasePrice": purchase_price,
+            "currentPrice": current_price,
+            "totalValue": round(quantity * current_price, 2),
+            "purchaseDate": (date(2020, 1, 1) + timedelta(days=rng.randrange(2000))).isoformat(),
+            "portfolioId": (asset_id - 1) // self.assets_per_portfolio + 1,
+        }
+
+    def transactions_for_asset(self, asset_id):
+        if not 1 <= asset_id <= self.users * self.portfolios_per_user * self.assets_per_portfolio:
+            return []
+        rng = random.Random(asset_id * 31)
+        first = (asset_id - 1) * self.transactions_per_asset + 1
+        start = datetime(2020, 1, 1)
+        return [
+            {
+                "id": tid,
+                "transactionType": rng.choice(["BUY", "SELL"]),
+                "transactionDate": (start + timedelta(minutes=(tid - first) * 97)).isoformat(),
+                "quantity": rng.randrange(1, 100),
+                "pricePerUnit": round(rng.uniform(5, 500), 2),
+                "assetId": asset_id,
+            }
+            for tid in range(first, first + self.transactions_per_asset)
+        ]
+
+    def users_page(self, page, size, sort_by="id"):
+        ids = range(page * size + 1, min((page + 1) * size, self.users) + 1)
+        content = [self.user(user_id) for user_id in ids]
+        if sort_by and content and sort_by in content[0]:
+            content.sort(key=lambda u: u[sort_by])
+        return {"content": content, "totalElements": self.users, "number": page, "size": size}
+
+    def user_by_email(self, email):
+        match = re.fullmatch(r"user(\d+)@example\.com", email)
+        return self.user(int(match.group(1))) if match else None
+
+    def user_by_account(self, account_number):
+        match = re.fullmatch(r"ACC(\d{8})", account_number)
+        return self.user(int(match.group(1))) if match else None
+
+
+# Function to compress a response body with the best encoding the client accepts
+def encode_body(body, accept_encoding):
+    accepted = [e.split(";")[0].strip() for e in (accept_encoding or "").split(",")]
+    if "br" in accepted and brotli is not None:
+        return brotli.compress(body, quality=4), "br"
+    if "gzip" in accepted:
+        return gzip.compress(body, compresslevel=5), "gzip"
+    if "deflate" in accepted:
+        return zlib.compress(body, 5), "deflate"
+    return body, None
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        body, encoding = encode_body(body, self.headers.get("Accept-Encoding"))
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self):
+        authorization = self.headers.get("Authorization") or ""
+        return authorization.startswith("Bearer ") and token_valid(authorization[len("Bearer "):])
+
+    def _issue_tokens(self, email):
+        refresh_token = secrets.token_urlsafe(32)
+        with self.server.refresh_lock:
+            self.server.refresh_tokens[refresh_token] = email
+        return {"token": issue_token(email, self.server.token_lifetime), "refreshToken": refresh_token}
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        path = urlparse(self.path).path
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            payload = {}
+        if not isinstance(payload, dict):
+            payload = {}
+        if path == "/api/auth/login":
+            email = payload.get("email") or "anonymous"
+            self.server.logins += 1
+            self._send_json(200, self._issue_tokens(email))
+        elif path == "/api/auth/refresh":
+            # Refresh tokens are single use: each refresh returns a new one
+            refresh_token = payload.get("refreshToken")
+            with self.server.refresh_lock:
+                email = self.server.refresh_tokens.pop(refresh_token, None) if isinstance(refresh_token, str) else None
+            if email is None:
+                self._send_json(401, {"message": "Invalid refresh token"})
+                return
+            self.server.refreshes += 1
+            self._send_json(200, self._issue_tokens(email))
+        else:
+            self._send_json(404, {"message": "Not found"})
+
+    def do_GET(self):
+        data = self.server.data
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        url = urlparse(self.path)
+        path = url.path
+        if path == "/health":
+            self._send_json(200, {"status": "UP"})
+            return
+        if not self._authorized():
+            self._send_json(401, {"message": "Unauthorized"})
+            return
+
+        query = parse_qs(url.query)
+        payload = None
+        if path == "/api/users":
+            payload = data.users_page(int(query.get("page", [0])[0]), int(query.get("size", [10])[0]),
+                                      query.get("sortBy", ["id"])[0])
+        elif path == "/api/users/count":
+            payload = {"count": data.users}
+        elif match := re.fullmatch(r"/api/users/email/(.+)", path):
+            payload = data.user_by_email(unquote(match.group(1)))
+        elif match := re.fullmatch(r"/api/users/account/(.+)", path):
+            payload = data.user_by_account(unquote(match.group(1)))
+        elif match := re.fullmatch(r"/api/users/(\d+)", path):
+            payload = data.user(int(match.group(1)))
+        elif match := re.fullmatch(r"/api/portfolios/user/(\d+)", path):
+            payload = data.portfolios_for_user(int(match.group(1)))
+        elif match := re.fullmatch(r"/api/assets/portfolio/(\d+)", path):
+            payload = data.assets_for_portfolio(int(match.group(1)))
+        elif match := re.fullmatch(r"/api/transactions/asset/(\d+)", path):
+            payload = data.transactions_for_asset(int(match.group(1)))
+
+        if payload is None:
+            self._send_json(404, {"message": "Not found"})
+        else:
+            self._send_json(200, payload)
+
+
+# Stand-in backend running in a background thread. Use as a context manager or call start()/stop().
+class MockBackend:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, token_lifetime=DEFAULT_TOKEN_LIFETIME_SECONDS, **sizes):
+        self.server = ThreadingHTTPServer((host, port), MockHandler)
+        self.server.daemon_threads = True
+        self.server.data = MockData(**sizes)
+        self.server.latency = latency
+        self.server.token_lifetime = token_lifetime
+        self.server.logins = 0
+        self.server.refreshes = 0
+        self.server.refresh_tokens = {}
+        self.server.refresh_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def data(self):
+        return self.server.data
+
+    @property
+    def root_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def base_url(self):
+        return f"{self.root_url}/api"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the Portfolio API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--portfolios-per-user", type=int, default=2)
+    parser.add_argument("--assets-per-portfolio", type=int, default=5)
+    parser.add_argument("--transactions-per-asset", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.0, help="Added delay per request, in seconds")
+    parser.add_argument("--token-lifetime", type=int, default=DEFAULT_TOKEN_LIFETIME_SECONDS,
+                        help="Lifetime of issued tokens, in seconds")
+    args = parser.parse_args()
+    backend = MockBackend(args.host, args.port, args.latency, args.token_lifetime, users=args.users,
+                          portfolios_per_user=args.portfolios_per_user,
+                          assets_per_portfolio=args.assets_per_portfolio,
+                          transactions_per_asset=args.transactions_per_asset)
+    print(f"Mock Portfolio API running at {backend.base_url}")
+    backend.server.serve_forever()
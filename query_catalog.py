@@ -0,0 +1,318 @@
+from query_engine import ENGINES
+
+# Pre-made SQL queries of the Advanced SQL Query tab, by name. Each entry lists the loaded
+# tables it needs, the message shown when they are missing, and the query. Reports that join
+# the source tables also have a fact_query answered from the wide transaction_facts table,
+# which is used by engines that read DataFrames in place. Engines that copy every table they
+# read would copy the whole fact table on each run, so they keep the joins. Queries written in
+# SQLite's dialect also have a version for each engine whose dialect differs, keyed
+# "<engine>_query" (e.g. duckdb_query). Queries with a LIMIT break ties in their ORDER BY, so
+# every engine returns the same rows.
+PREMADE_QUERIES = {
+    "Users with Most Portfolios": {
+        "requires": ["users", "portfolios"],
+        "missing": "Users and Portfolios data must be loaded.",
+        "query": """
+            SELECT u.id, u.name, COUNT(p.id) AS portfolio_count
+            FROM users u
+            JOIN portfolios p ON u.id = p.user_id
+            GROUP BY u.id, u.name
+            ORDER BY portfolio_count DESC
+        """,
+        "fact_query": """
+            SELECT user_id AS id, user_name AS name, COUNT(DISTINCT portfolio_id) AS portfolio_count
+            FROM transaction_facts
+            WHERE user_id IS NOT NULL AND portfolio_id IS NOT NULL
+            GROUP BY user_id, user_name
+            ORDER BY portfolio_count DESC
+        """,
+    },
+    "Assets with Highest Total Value": {
+        "requires": ["assets"],
+        "missing": "Assets data must be loaded.",
+        "query": """
+            SELECT symbol, asset_type, SUM(total_value) AS total_value_sum
+            FROM assets
+            GROUP BY symbol, asset_type
+            ORDER BY total_value_sum DESC, symbol, asset_type
+            LIMIT 10
+        """,
+    },
+    "Transactions Summary per Asset": {
+        "requires": ["transactions", "assets"],
+        "missing": "Assets and Transactions data must be loaded.",
+        "query": """
+            SELECT a.symbol, COUNT(t.id) AS transaction_count, SUM(t.quantity) AS total_quantity
+            FROM transactions t
+            JOIN assets a ON t.asset_id = a.id
+            GROUP BY a.symbol
+            ORDER BY transaction_count DESC
+        """,
+        "fact_query": """
+            SELECT asset_symbol AS symbol, COUNT(transaction_id) AS transaction_count,
+                   SUM(transaction_quantity) AS total_quantity
+            FROM transaction_facts
+            WHERE transaction_id IS NOT NULL AND asset_id IS NOT NULL
+            GROUP BY asset_symbol
+            ORDER BY transaction_count DESC
+        """,
+    },
+    "Users with No Portfolios": {
+        "requires": ["users", "portfolios"],
+        "missing": "Users and Portfolios data must be loaded.",
+        "query": """
+            SELECT u.id, u.name
+            FROM users u
+            LEFT JOIN portfolios p ON u.id = p.user_id
+            WHERE p.id IS NULL
+        """,
+        "fact_query": """
+            SELECT user_id AS id, user_name AS name
+            FROM transaction_facts
+            WHERE grain = 'user'
+        """,
+    },
+    "Portfolios with No Assets": {
+        "requires": ["portfolios", "assets"],
+        "missing": "Portfolios and Assets data must be loaded.",
+        "query": """
+            SELECT p.id, p.portfolio_name
+            FROM portfolios p
+            LEFT JOIN assets a ON p.id = a.portfolio_id
+            WHERE a.id IS NULL
+        """,
+        "fact_query": """
+            SELECT portfolio_id AS id, portfolio_name
+            FROM transaction_facts
+            WHERE grain = 'portfolio'
+        """,
+    },
+    "Top 5 Most Traded Assets": {
+        "requires": ["transactions", "assets"],
+        "missing": "Assets and Transactions data must be loaded.",
+        "query": """
+            SELECT a.symbol, COUNT(t.id) AS trade_count
+            FROM transactions t
+            JOIN assets a ON t.asset_id = a.id
+            GROUP BY a.symbol
+            ORDER BY trade_count DESC, symbol
+            LIMIT 5
+        """,
+        "fact_query": """
+            SELECT asset_symbol AS symbol, COUNT(transaction_id) AS trade_count
+            FROM transaction_facts
+            WHERE transaction_id IS NOT NULL AND asset_id IS NOT NULL
+            GROUP BY asset_symbol
+            ORDER BY trade_count DESC, symbol
+            LIMIT 5
+        """,
+    },
+    "Average Asset Value per Portfolio": {
+        "requires": ["assets", "portfolios"],
+        "missing": "Assets and Portfolios data must be loaded.",
+        "query": """
+            SELECT p.portfolio_name, AVG(a.total_value) AS average_value
+            FROM assets a
+            JOIN portfolios p ON a.portfolio_id = p.id
+            GROUP BY p.portfolio_name
+            ORDER BY average_value DESC
+        """,
+        "fact_query": """
+            SELECT portfolio_name, AVG(asset_total_value) AS average_value
+            FROM (
+                SELECT DISTINCT asset_id, portfolio_name, asset_total_value
+                FROM transaction_facts
+                WHERE asset_id IS NOT NULL AND portfolio_id IS NOT NULL
+            )
+            GROUP BY portfolio_name
+            ORDER BY average_value DESC
+        """,
+    },
+    "Users with Portfolios Exceeding a Total Value": {
+        "requires": ["users", "portfolios", "assets"],
+        "missing": "Users, Portfolios, and Assets data must be loaded.",
+        "query": """
+            SELECT u.id, u.name, SUM(a.total_value) AS total_portfolio_value
+            FROM users u
+            JOIN portfolios p ON u.id = p.user_id
+            JOIN assets a ON p.id = a.portfolio_id
+            GROUP BY u.id, u.name
+            HAVING SUM(a.total_value) > 100000
+            ORDER BY total_portfolio_value DESC
+        """,
+        "fact_query": """
+            SELECT user_id AS id, user_name AS name, SUM(asset_total_value) AS total_portfolio_value
+            FROM (
+                SELECT DISTINCT asset_id, user_id, user_name, asset_total_value
+                FROM transaction_facts
+                WHERE asset_id IS NOT NULL AND portfolio_id IS NOT NULL AND user_id IS NOT NULL
+            )
+            GROUP BY user_id, user_name
+            HAVING SUM(asset_total_value) > 100000
+            ORDER BY total_portfolio_value DESC
+        """,
+    },
+    "Assets Purchased in Last 30 Days": {
+        "requires": ["assets"],
+        "missing": "Assets data must be loaded.",
+        "query": """
+            SELECT *
+            FROM assets
+            WHERE purchase_date >= DATE('now', '-30 days')
+        """,
+        "duckdb_query": """
+            SELECT *
+            FROM assets
+            WHERE purchase_date >= strftime(CURRENT_DATE - INTERVAL 30 DAY, '%Y-%m-%d')
+        """,
+    },
+    "Users by Age Group": {
+        "requires": ["users"],
+        "missing": "Users data must be loaded.",
+        "query": """
+            SELECT
+                CASE
+                    WHEN date_of_birth <= DATE('now', '-60 years') THEN '60+'
+                    WHEN date_of_birth <= DATE('now', '-50 years') THEN '50-59'
+                    WHEN date_of_birth <= DATE('now', '-40 years') THEN '40-49'
+                    WHEN date_of_birth <= DATE('now', '-30 years') THEN '30-39'
+                    ELSE 'Under 30'
+                END AS age_group,
+                COUNT(*) AS user_count
+            FROM users
+            GROUP BY age_group
+            ORDER BY
+                CASE age_group
+                    WHEN 'Under 30' THEN 1
+                    WHEN '30-39' THEN 2
+                    WHEN '40-49' THEN 3
+                    WHEN '50-59' THEN 4
+                    WHEN '60+' THEN 5
+                END
+        """,
+        "duckdb_query": """
+            SELECT
+                CASE
+                    WHEN date_of_birth <= strftime(CURRENT_DATE - INTERVAL 60 YEAR, '%Y-%m-%d') THEN '60+'
+                    WHEN date_of_birth <= strftime(CURRENT_DATE - INTERVAL 50 YEAR, '%Y-%m-%d') THEN '50-59'
+                    WHEN date_of_birth <= strftime(CURRENT_DATE - INTERVAL 40 YEAR, '%Y-%m-%d') THEN '40-49'
+                    WHEN date_of_birth <= strftime(CURRENT_DATE - INTERVAL 30 YEAR, '%Y-%m-%d') THEN '30-39'
+                    ELSE 'Under 30'
+                END AS age_group,
+                COUNT(*) AS user_count
+            FROM users
+            GROUP BY age_group
+            ORDER BY
+                CASE age_group
+                    WHEN 'Under 30' THEN 1
+                    WHEN '30-39' THEN 2
+                    WHEN '40-49' THEN 3
+                    WHEN '50-59' THEN 4
+                    WHEN '60+' THEN 5
+                END
+        """,
+    },
+    "Assets Distribution by Type": {
+        "requires": ["assets"],
+        "missing": "Assets data must be loaded.",
+        "query": """
+            SELECT asset_type, COUNT(*) AS asset_count
+            FROM assets
+            GROUP BY asset_type
+            ORDER BY asset_count DESC
+        """,
+    },
+    "Transactions Above Average Quantity": {
+        "requires": ["transactions"],
+        "missing": "Transactions data must be loaded.",
+        "query": """
+            SELECT *
+            FROM transactions
+            WHERE quantity > (SELECT AVG(quantity) FROM transactions)
+            ORDER BY quantity DESC
+        """,
+    },
+    "Portfolios with Diversified Assets": {
+        "requires": ["portfolios", "assets"],
+        "missing": "Portfolios and Assets data must be loaded.",
+        "query": """
+            SELECT p.portfolio_name, COUNT(DISTINCT a.asset_type) AS asset_type_count
+            FROM portfolios p
+            JOIN assets a ON p.id = a.portfolio_id
+            GROUP BY p.portfolio_name
+            HAVING COUNT(DISTINCT a.asset_type) >= 3
+            ORDER BY asset_type_count DESC
+        """,
+        "fact_query": """
+            SELECT portfolio_name, COUNT(DISTINCT asset_type) AS asset_type_count
+            FROM transaction_facts
+            WHERE asset_id IS NOT NULL AND portfolio_id IS NOT NULL
+            GROUP BY portfolio_name
+            HAVING COUNT(DISTINCT asset_type) >= 3
+            ORDER BY asset_type_count DESC
+        """,
+    },
+    "Inactive Users (No Transactions)": {
+        "requires": ["users", "transactions"],
+        "missing": "Users, Portfolios, Assets, and Transactions data must be loaded.",
+        "query": """
+            SELECT u.id, u.name
+            FROM users u
+            LEFT JOIN portfolios p ON u.id = p.user_id
+            LEFT JOIN assets a ON p.id = a.portfolio_id
+            LEFT JOIN transactions t ON a.id = t.asset_id
+            WHERE t.id IS NULL
+            GROUP BY u.id, u.name
+        """,
+        "fact_query": """
+            SELECT user_id AS id, user_name AS name
+            FROM transaction_facts
+            WHERE user_id IS NOT NULL AND transaction_id IS NULL
+            GROUP BY user_id, user_name
+        """,
+    },
+    "Top Performing Assets by Return Rate": {
+        "requires": ["assets"],
+        "missing": "Assets data must be loaded.",
+        "query": """
+            SELECT symbol, ((current_price - purchase_price) / purchase_price) * 100 AS return_rate
+            FROM assets
+            ORDER BY return_rate DESC, symbol
+            LIMIT 10
+        """,
+    },
+    "Custom Subquery": {
+        "requires": [],
+        # Shown with its SQL, as an example to adapt in the query box
+        "show_query": True,
+        "query": """
+            SELECT u.name, p.portfolio_name
+            FROM users u
+            JOIN portfolios p ON u.id = p.user_id
+            WHERE p.id IN (SELECT portfolio_id FROM assets WHERE asset_type = 'Stock')
+        """,
+    },
+    "Window Functions Example": {
+        "requires": ["transactions"],
+        "missing": "Transactions data must be loaded.",
+        "query": """
+            SELECT
+                t.id,
+                t.transaction_type,
+                t.quantity,
+                t.price_per_unit,
+                AVG(t.quantity) OVER (PARTITION BY t.transaction_type) AS avg_quantity
+            FROM transactions t
+            ORDER BY t.transaction_type
+        """,
+    },
+}
+
+
+# Function to get the SQL of a pre-made query for an engine
+def premade_query(premade, engine_name):
+    if f"{engine_name}_query" in premade:
+        return premade[f"{engine_name}_query"]
+    if "fact_query" in premade and ENGINES[engine_name].reads_in_place:
+        return premade["fact_query"]
+    return premade["query"]
@@ -0,0 +1,200 @@
+import sqlite3
+from abc import ABC, abstractmethod
+
+import pandas as pd
+import pandasql as psql
+from pandasql.sqldf import extract_table_names, write_table
+
+from query_export import DEFAULT_CHUNK_SIZE, stream_query
+from query_log import explain_query
+
+try:
+    import duckdb
+except ImportError:  # the DuckDB engine is only offered when duckdb is installed
+    duckdb = None
+
+try:
+    import pyarrow as pa
+except ImportError:  # DuckDB then scans the DataFrames themselves
+    pa = None
+
+# Engine used when none is chosen: pandasql, which the app has always used
+DEFAULT_ENGINE = "pandasql"
+
+
+# Interface of a SQL engine running queries over DataFrames. Tables are registered by name;
+# execute() returns the whole result, stream() yields it in DataFrames of at most chunk_size
+# rows (at least one, so an empty result still has its columns), and explain() returns the
+# query plan as indented lines. Engines that read the DataFrames in place set reads_in_place;
+# the others copy every table a query reads.
+class QueryEngine(ABC):
+    name = None
+    reads_in_place = False
+
+    def __init__(self):
+        self.tables = {}
+
+    # Function to make a DataFrame queryable as `name`, replacing any table of that name
+    def register(self, name, df):
+        self.tables[name] = df
+
+    # Function to register the tables a query reads from a mapping of loaded tables, such as a
+    # StoreView. Tables already registered with the same DataFrame are not registered again.
+    def register_for(self, query, tables):
+        for name in extract_table_names(query):
+            if name in tables and self.tables.get(name) is not tables[name]:
+                self.register(name, tables[name])
+        return self
+
+    @abstractmethod
+    def execute(self, query):
+        pass
+
+    @abstractmethod
+    def stream(self, query, chunk_size=DEFAULT_CHUNK_SIZE):
+        pass
+
+    @abstractmethod
+    def explain(self, query):
+        pass
+
+    def close(self):
+        pass
+
+
+# SQLite through pandasql. Tables are copied into a fresh in-memory database the first time a
+# query reads them.
+class PandasqlEngine(QueryEngine):
+    name = "pandasql"
+
+    def __init__(self):
+        super().__init__()
+        self._pdsql = psql.PandaSQL(persist=True)
+
+    def register(self, name, df):
+        if name in self._pdsql.loaded_tables:
+            # pandasql never rewrites a table it has loaded, so start over with a new database
+            self.close()
+            self._pdsql = psql.PandaSQL(persist=True)
+        super().register(name, df)
+
+    def execute(self, query):
+        return self._pdsql(query, self.tables)
+
+    # Streams from pandasql's own database, so the tables are only copied once per engine. The
+    # plain sqlite3 connection under it is read the same way the sqlite engine reads its own.
+    def stream(self, query, chunk_size=DEFAULT_CHUNK_SIZE):
+        self._load(query)
+        yield from stream_query(self._pdsql._conn.connection.dbapi_connection, query, chunk_size)
+
+    # Function to copy the tables a query reads into pandasql's database, as running the query
+    # through pandasql would
+    def _load(self, query):
+        for name in extract_table_names(query):
+            if name in self.tables and name not in self._pdsql.loaded_tables:
+                self._pdsql.loaded_tables.add(name)
+                write_table(self.tables[name], name, self._pdsql._conn)
+
+    def explain(self, query):
+        return explain_query(self._pdsql, query, self.tables)
+
+    # PandaSQL has no close(). Closing its connection here keeps the garbage collector from
+    # closing it later on another thread, which SQLite does not allow.
+    def close(self):
+        self._pdsql._conn.close()
+
+
+# SQLite on a plain sqlite3 connection. Tables are copied in when registered, with an index on
+# every id column, so the joins and lookups of the pre-made queries do not scan whole tables.
+class SQLiteEngine(QueryEngine):
+    name = "sqlite"
+
+    def __init__(self):
+        super().__init__()
+        self.conn = sqlite3.connect(":memory:")
+
+    def register(self, name, df):
+        super().register(name, df)
+        self.conn.execute(f'DROP TABLE IF EXISTS "{name}"')
+        write_table(df, name, self.conn)
+        for col in df.columns:
+            if col == "id" or str(col).endswith("_id"):
+                self.conn.execute(f'CREATE INDEX "ix_{name}_{col}" ON "{name}" ("{col}")')
+
+    def execute(self, query):
+        return pd.read_sql_query(query.strip().rstrip(";"), self.conn)
+
+    def stream(self, query, chunk_size=DEFAULT_CHUNK_SIZE):
+        yield from stream_query(self.conn, query, chunk_size)
+
+    def explain(self, query):
+        return explain_query(lambda sql, _tables: pd.read_sql_query(sql, self.conn), query, self.tables)
+
+    def close(self):
+        self.conn.close()
+
+
+# DuckDB, a columnar engine that queries the DataFrames in place instead of copying them.
+# Its SQL dialect differs from SQLite's in places, e.g. DATE('now', '-30 days') is not supported.
+class DuckDBEngine(QueryEngine):
+    name = "duckdb"
+    reads_in_place = True
+
+    def __init__(self):
+        super().__init__()
+        if duckdb is None:
+            raise ImportError("The DuckDB engine requires duckdb. Install it with 'pip install duckdb'.")
+        self.conn = duckdb.connect()
+
+    def register(self, name, df):
+        super().register(name, df)
+        self.conn.register(name, _to_arrow(df))
+
+    def execute(self, query):
+        return self.conn.execute(query.strip().rstrip(";")).df()
+
+    def stream(self, query, chunk_size=DEFAULT_CHUNK_SIZE):
+        reader = self.conn.execute(query.strip().rstrip(";")).fetch_record_batch(chunk_size)
+        empty = True
+        for batch in reader:
+            empty = False
+            yield batch.to_pandas()
+        # An empty result has no batches. Yield its columns anyway, as the SQLite engines do,
+        # so exports still get a header and a schema.
+        if empty:
+            yield reader.schema.empty_table().to_pandas()
+
+    def explain(self, query):
+        rows = self.conn.execute(f"EXPLAIN {query.strip().rstrip(';')}").fetchall()
+        # Drop the box-drawing borders around each plan step
+        lines = (line.strip(" │┌┐└┘─┬┴├┤") for _, plan in rows for line in plan.splitlines())
+        return [line for line in lines if line]
+
+    def close(self):
+        self.conn.close()
+
+
+# Function to get a DataFrame as an Arrow table when pyarrow can convert it. DuckDB reads Arrow
+# columns directly, while it scans pandas string columns value by value.
+def _to_arrow(df):
+    if pa is None:
+        return df
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        return df
+
+
+ENGINES = {engine.name: engine for engine in [PandasqlEngine, SQLiteEngine, DuckDBEngine]}
+
+
+# Function to list the engines available in this environment
+def engine_names():
+    return [name for name in ENGINES if name != "duckdb" or duckdb is not None]
+
+
+# Function to create a new engine by name. Close it when done to free its copies of the tables.
+def open_engine(name=DEFAULT_ENGINE):
+    if name not in ENGINES:
+        raise ValueError(f"Unknown query engine: {name}")
+    return ENGINES[name]()
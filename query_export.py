@@ -0,0 +1,195 @@
+import os
+import shutil
+import tempfile
+import uuid
+import weakref
+from datetime import datetime
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is only offered when pyarrow is installed
+    pa = None
+    pq = None
+
+# Number of rows fetched from SQLite and written to the export file at a time
+DEFAULT_CHUNK_SIZE = 50000
+
+# Exports are written here on the server before they are offered for download
+EXPORT_DIR = os.path.join(tempfile.gettempdir(), "finance_frontend_exports")
+
+# Larger exports stay on the server, since offering them for download loads the file into memory
+MAX_DOWNLOAD_BYTES = 200 * 1024 * 1024
+
+FILE_EXTENSIONS = {"CSV": "csv", "Parquet": "parquet"}
+MIME_TYPES = {"CSV": "text/csv", "Parquet": "application/octet-stream"}
+
+
+# Function to list the export formats available in this environment
+def export_formats():
+    return ["CSV", "Parquet"] if pq is not None else ["CSV"]
+
+
+# Function to build a unique path for a new export file
+def new_export_path(file_format, export_dir=EXPORT_DIR):
+    os.makedirs(export_dir, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return os.path.join(export_dir, f"query_{timestamp}_{uuid.uuid4().hex[:8]}.{FILE_EXTENSIONS[file_format]}")
+
+
+# Export files of one session, kept in a directory of their own under EXPORT_DIR
+class SessionExports:
+    def __init__(self):
+        self.export_dir = os.path.join(EXPORT_DIR, uuid.uuid4().hex)
+        # Remove the export files once the session is gone
+        weakref.finalize(self, shutil.rmtree, self.export_dir, True)
+
+    # Function to build a unique path for a new export file of this session
+    def new_path(self, file_format):
+        return new_export_path(file_format, self.export_dir)
+
+
+# Function to get the path an export is written to until it is complete. A stopped export
+# never leaves a truncated file under its final name.
+def partial_export_path(path):
+    return f"{path}.part"
+
+
+# Function to delete an export file and any partial file of it
+def discard_export(path):
+    for file_path in (path, partial_export_path(path)):
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+
+
+# Function to stream the result of a query in DataFrames of at most chunk_size rows
+def stream_query(conn, query, chunk_size=DEFAULT_CHUNK_SIZE):
+    query = query.strip().rstrip(";")
+    yield from pd.read_sql_query(query, conn, chunksize=chunk_size)
+
+
+# Function to write chunks to a CSV file. Returns the number of rows written.
+def write_csv(chunks, path):
+    rows = 0
+    with open(path, "w", newline="") as f:
+        for i, chunk in enumerate(chunks):
+            chunk.to_csv(f, header=(i == 0), index=False)
+            rows += len(chunk)
+    return rows
+
+
+# Function to get the Arrow type a column converts to. Columns mixing values of different
+# types, which SQLite allows, are stored as strings.
+def _arrow_type(column):
+    try:
+        return pa.Array.from_pandas(column).type
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.string()
+
+
+# Function to derive the Parquet schema from the first chunk.
+# Columns that are entirely NULL in the first chunk are stored as strings.
+def _parquet_schema(chunk):
+    try:
+        schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        schema = pa.schema([pa.field(name, _arrow_type(chunk.iloc[:, i])) for i, name in enumerate(chunk.columns)])
+    fields = [pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f for f in schema]
+    return pa.schema(fields, metadata=schema.metadata)
+
+
+def _is_number(arrow_type):
+    return pa.types.is_integer(arrow_type) or pa.types.is_floating(arrow_type) or pa.types.is_boolean(arrow_type)
+
+
+# Function to widen a Parquet schema so it also holds a chunk that does not fit it. SQLite
+# columns can change type between chunks: numeric columns that do become float64 and any other
+# mix becomes a string column.
+def _widen_schema(schema, chunk):
+    fields = []
+    for i, field in enumerate(schema):
+        chunk_type = _arrow_type(chunk.iloc[:, i])
+        if chunk_type == field.type or pa.types.is_null(chunk_type) or pa.types.is_string(field.type):
+            fields.append(field)
+        elif _is_number(field.type) and _is_number(chunk_type):
+            fields.append(pa.field(field.name, pa.float64()))
+        else:
+            fields.append(pa.field(field.name, pa.string()))
+    return pa.schema(fields)
+
+
+# Function to convert a chunk to an Arrow table matching the schema of the file being written
+def _to_arrow(chunk, schema):
+    chunk = chunk.copy()
+    for field in schema:
+        if pa.types.is_string(field.type):
+            chunk[field.name] = chunk[field.name].map(lambda v: None if pd.isna(v) else str(v))
+    return pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+
+
+# Function to rewrite the row groups written so far to a new file with a wider schema.
+# Returns the writer of the new file, ready for the remaining chunks.
+def _rewrite_parquet(path, schema):
+    old_path = f"{path}.old"
+    os.replace(path, old_path)
+    try:
+        writer = pq.ParquetWriter(path, schema)
+        try:
+            old_file = pq.ParquetFile(old_path)
+            for i in range(old_file.num_row_groups):
+                writer.write_table(old_file.read_row_group(i).cast(schema))
+        except Exception:
+            writer.close()
+            raise
+    finally:
+        os.remove(old_path)
+    return writer
+
+
+# Function to write chunks to a Parquet file, one row group per chunk. Returns the number of rows
+# written. When a chunk does not fit the schema taken from the first one, the file is rewritten
+# with a wider schema, a row group at a time.
+def write_parquet(chunks, path):
+    if pq is None:
+        raise ImportError("Parquet export requires pyarrow. Install it with 'pip install pyarrow'.")
+    rows = 0
+    writer = None
+    try:
+        for chunk in chunks:
+            if writer is None:
+                writer = pq.ParquetWriter(path, _parquet_schema(chunk))
+            try:
+                table = _to_arrow(chunk, writer.schema)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                schema = _widen_schema(writer.schema, chunk)
+                writer.close()
+                writer = _rewrite_parquet(path, schema)
+                table = _to_arrow(chunk, schema)
+            writer.write_table(table)
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+# Function to export the result of a query to a file without holding the whole result in memory.
+# The query runs on `engine`, a QueryEngine with the tables it reads registered. The file is
+# written under a partial name and renamed to `path` once complete.
+def export_query(engine, query, path, file_format="CSV", chunk_size=DEFAULT_CHUNK_SIZE):
+    chunks = engine.stream(query, chunk_size)
+    partial_path = partial_export_path(path)
+    try:
+        if file_format == "Parquet":
+            rows = write_parquet(chunks, partial_path)
+        else:
+            rows = write_csv(chunks, partial_path)
+    except Exception:
+        discard_export(path)
+        raise
+    os.replace(partial_path, path)
+    return rows
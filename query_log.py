@@ -0,0 +1,110 @@
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import pandas as pd
+from pandasql.sqldf import extract_table_names
+
+# Queries slower than this (in seconds) are recorded in the slow-query log
+DEFAULT_SLOW_QUERY_THRESHOLD_SECONDS = 1.0
+
+# Maximum number of entries kept in a log; the oldest entries are dropped first
+MAX_LOG_ENTRIES = 500
+
+
+# Function to count the rows of every loaded table the query reads from
+def input_table_sizes(query, tables):
+    return {name: len(tables[name]) for name in sorted(extract_table_names(query)) if name in tables}
+
+
+# Function to turn EXPLAIN QUERY PLAN rows into indented lines, one per plan step
+def format_query_plan(plan_df):
+    depths = {0: -1}
+    lines = []
+    for row in plan_df.itertuples(index=False):
+        depth = depths.get(row.parent, -1) + 1
+        depths[row.id] = depth
+        lines.append("  " * depth + str(row.detail))
+    return lines
+
+
+# Function to get the query plan. run_sql(sql, tables) runs SQL against a connection that
+# already has the tables loaded, such as a persistent PandaSQL instance.
+def explain_query(run_sql, query, tables):
+    query = query.strip().rstrip(";")
+    return format_query_plan(run_sql(f"EXPLAIN QUERY PLAN {query}", tables))
+
+
+# Function to summarize the expensive steps of a query plan
+def plan_warnings(plan_lines):
+    steps = [line.strip() for line in plan_lines]
+    full_scans = sum(1 for step in steps if step.startswith("SCAN") and "USING" not in step)
+    warnings = []
+    if full_scans:
+        warnings.append(f"{full_scans} full scan(s)")
+    if full_scans > 1:
+        warnings.append("nested-loop join over full scans")
+    if any("TEMP B-TREE" in step for step in steps):
+        warnings.append("temp b-tree")
+    if any("AUTOMATIC" in step for step in steps):
+        warnings.append("automatic index")
+    return ", ".join(warnings)
+
+
+# Slow-query log of one session. Each session keeps its own log, so users only see and clear
+# the queries they ran themselves.
+class SlowQueryLog:
+    def __init__(self, max_entries=MAX_LOG_ENTRIES):
+        self._entries = deque(maxlen=max_entries)
+        self._lock = threading.Lock()
+
+    # Function to add a query to the log
+    def record(self, source, query, elapsed, plan_lines, table_sizes, row_count, status="ok", engine=None):
+        entry = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "source": source,
+            "engine": engine,
+            "status": status,
+            "elapsed_seconds": round(elapsed, 3),
+            "row_count": row_count,
+            "input_tables": ", ".join(f"{name}={rows}" for name, rows in table_sizes.items()),
+            "plan_warnings": plan_warnings(plan_lines or []),
+            "query_plan": "\n".join(plan_lines or []),
+            "query": query.strip(),
+        }
+        with self._lock:
+            self._entries.append(entry)
+
+    # Function to get the log as a DataFrame, newest first
+    def to_frame(self):
+        with self._lock:
+            entries = list(self._entries)
+        return pd.DataFrame(list(reversed(entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Function to run a query on a QueryEngine, timing it and adding it to `log` if it is slow.
+# The tables the query reads are registered from `tables` first.
+def run_logged_query(engine, query, tables, source, log, threshold=DEFAULT_SLOW_QUERY_THRESHOLD_SECONDS):
+    engine.register_for(query, tables)
+    start = time.perf_counter()
+    result_df = None
+    status = "error"
+    try:
+        result_df = engine.execute(query)
+        status = "ok"
+        return result_df
+    finally:
+        elapsed = time.perf_counter() - start
+        if elapsed >= threshold:
+            try:
+                plan_lines = engine.explain(query)
+            except Exception:
+                plan_lines = []
+            row_count = len(result_df) if result_df is not None else None
+            log.record(source, query, elapsed, plan_lines, input_table_sizes(query, tables), row_count, status,
+                       engine.name)
@@ -0,0 +1,269 @@
+import multiprocessing as mp
+import os
+import sys
+import threading
+import time
+import types
+
+import pandas as pd
+
+from query_engine import DEFAULT_ENGINE, open_engine
+from query_export import DEFAULT_CHUNK_SIZE, discard_export, export_query
+from query_log import DEFAULT_SLOW_QUERY_THRESHOLD_SECONDS, input_table_sizes
+
+# Default limits for ad-hoc queries
+DEFAULT_TIMEOUT_SECONDS = 30
+DEFAULT_ROW_LIMIT = 100000
+DEFAULT_MEMORY_LIMIT_MB = 1024
+
+# Exit codes used by the worker watchdog so the parent can tell why it stopped
+TIMEOUT_EXIT_CODE = 124
+MEMORY_EXIT_CODE = 125
+
+# How often the watchdog and the parent check on a running query
+POLL_INTERVAL_SECONDS = 0.2
+
+# Modules imported once by the forkserver, so that each query worker is forked with them
+# already loaded instead of importing pandas, SQLAlchemy and the engines (1-2 s) itself.
+# The forkserver does not get the server's sys.path, so this module is only preloaded when
+# the app runs from its own directory; the third-party modules, which make up nearly all of
+# the import time, are found either way. Modules that are not installed are skipped.
+WORKER_PRELOAD = [__name__, "pandas", "pandasql", "sqlalchemy", "duckdb", "pyarrow.parquet", "pyarrow.feather"]
+
+
+# Function to pick a multiprocessing context that is safe to use from the Streamlit server.
+# Forking a multi-threaded server process can deadlock, so workers come from a forkserver
+# (or are spawned) instead.
+def get_context():
+    if "forkserver" in mp.get_all_start_methods():
+        ctx = mp.get_context("forkserver")
+        ctx.set_forkserver_preload(WORKER_PRELOAD)
+        return ctx
+    return mp.get_context("spawn")
+
+
+# Serializes worker starts, which briefly replace the __main__ module
+_start_lock = threading.Lock()
+
+
+# Function to start a worker process. Streamlit runs the app script as the __main__ module, and
+# multiprocessing re-runs the file of __main__ in every child before unpickling its target, so
+# each query worker would re-run the whole app script. Workers only need this module, so
+# __main__ is replaced with an empty module while the worker starts.
+def _start_worker(process):
+    with _start_lock:
+        main_module = sys.modules["__main__"]
+        sys.modules["__main__"] = types.ModuleType("__main__")
+        try:
+            process.start()
+        finally:
+            sys.modules["__main__"] = main_module
+
+
+# Function to read the resident memory of the current process in bytes
+def current_rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        return None
+
+
+# Watchdog thread run inside the worker. It hard-exits the process when the
+# query runs past its deadline or its memory budget, even while SQLite is busy in C code.
+# The budget applies to the memory the worker gains above baseline_bytes, its size when it
+# started with the preloaded libraries and the tables it was given.
+def _watchdog(timeout, memory_limit_bytes, baseline_bytes):
+    deadline = time.monotonic() + timeout
+    while True:
+        if time.monotonic() > deadline:
+            os._exit(TIMEOUT_EXIT_CODE)
+        if memory_limit_bytes and baseline_bytes is not None:
+            rss = current_rss_bytes()
+            if rss is not None and rss - baseline_bytes > memory_limit_bytes:
+                os._exit(MEMORY_EXIT_CODE)
+        time.sleep(POLL_INTERVAL_SECONDS / 2)
+
+
+# Function to run a query in the worker and return its (limited) result. The query runs as
+# written and only its first row_limit + 1 rows are fetched; the extra row tells us whether the
+# result was truncated.
+def _run_query(conn, engine, query, row_limit):
+    _send_plan(conn, engine, query)
+    chunks = engine.stream(query, row_limit + 1)
+    fetched = []
+    try:
+        for chunk in chunks:
+            fetched.append(chunk)
+            if sum(len(df) for df in fetched) > row_limit:
+                break
+    finally:
+        chunks.close()
+    result_df = pd.concat(fetched, ignore_index=True) if len(fetched) > 1 else fetched[0]
+    return {"result_df": result_df.head(row_limit), "truncated": len(result_df) > row_limit}
+
+
+# Function to stream the full result of a query into an export file in the worker
+def _run_export(conn, engine, query, export_path, export_format, chunk_size):
+    _send_plan(conn, engine, query)
+    return {"rows_exported": export_query(engine, query, export_path, export_format, chunk_size)}
+
+
+# Send the plan before running the query so it is known even if the query gets stopped
+def _send_plan(conn, engine, query):
+    try:
+        conn.send(("plan", engine.explain(query)))
+    except Exception:
+        conn.send(("plan", []))
+
+
+# Entry point of the worker process. Messages sent back to the parent are
+# (kind, payload) pairs: first the query plan, then either the result or an error
+# together with the time spent in the worker.
+def _run_worker(conn, query, tables, row_limit, timeout, memory_limit_mb, export_path, export_format, chunk_size,
+                engine_name):
+    memory_limit_bytes = memory_limit_mb * 1024 * 1024 if memory_limit_mb else None
+    baseline_bytes = current_rss_bytes()
+    threading.Thread(target=_watchdog, args=(timeout, memory_limit_bytes, baseline_bytes), daemon=True).start()
+    start = time.perf_counter()
+    engine = None
+    try:
+        engine = open_engine(engine_name).register_for(query, tables)
+        if export_path:
+            result = _run_export(conn, engine, query, export_path, export_format, chunk_size)
+        else:
+            result = _run_query(conn, engine, query, row_limit)
+        result["seconds"] = time.perf_counter() - start
+        conn.send(("ok", result))
+    except MemoryError:
+        conn.send(("error", (f"Query exceeded the memory limit of {memory_limit_mb} MB.", time.perf_counter() - start)))
+    except Exception as e:
+        conn.send(("error", (str(e), time.perf_counter() - start)))
+    finally:
+        if engine is not None:
+            engine.close()
+        conn.close()
+
+
+# A query running in its own worker process with a wall-clock timeout,
+# a row limit and a memory limit. Call poll() until it returns True, or cancel() it.
+# Queries slower than slow_query_threshold are added to slow_query_log, a SlowQueryLog, if given.
+# When export_path is given the full result is streamed into that file in chunks
+# instead of being returned, and the row limit does not apply.
+# The query runs on the QueryEngine named by `engine`.
+class QueryJob:
+    def __init__(self, query, tables, timeout=DEFAULT_TIMEOUT_SECONDS, row_limit=DEFAULT_ROW_LIMIT,
+                 memory_limit_mb=DEFAULT_MEMORY_LIMIT_MB, slow_query_threshold=DEFAULT_SLOW_QUERY_THRESHOLD_SECONDS,
+                 source="Ad-hoc query", export_path=None, export_format="CSV", chunk_size=DEFAULT_CHUNK_SIZE,
+                 engine=DEFAULT_ENGINE, slow_query_log=None):
+        self.query = query
+        self.timeout = timeout
+        self.row_limit = row_limit
+        self.memory_limit_mb = memory_limit_mb
+        self.slow_query_threshold = slow_query_threshold
+        self.slow_query_log = slow_query_log
+        self.source = source
+        self.engine = engine
+        self.table_sizes = input_table_sizes(query, tables)
+        self.plan_lines = []
+        # Time spent running the query in the worker, excluding worker start-up
+        self.query_seconds = None
+        self.result_df = None
+        self.truncated = False
+        self.export_path = export_path
+        self.export_format = export_format
+        self.rows_exported = None
+        self.error = None
+        self.status = "running"
+        self.done = False
+
+        ctx = get_context()
+        self._conn, child_conn = ctx.Pipe(duplex=False)
+        self.process = ctx.Process(
+            target=_run_worker,
+            args=(child_conn, query, tables, row_limit, timeout, memory_limit_mb, export_path, export_format, chunk_size,
+                  engine),
+            daemon=True,
+        )
+        self.started = time.monotonic()
+        _start_worker(self.process)
+        child_conn.close()
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    # Wait up to interval seconds for the query to finish. Returns True once it is done.
+    def poll(self, interval=POLL_INTERVAL_SECONDS):
+        if self.done:
+            return True
+        try:
+            while self._conn.poll(interval):
+                kind, payload = self._conn.recv()
+                if kind == "plan":
+                    self.plan_lines = payload
+                    continue
+                if kind == "ok":
+                    self.result_df = payload.get("result_df")
+                    self.truncated = payload.get("truncated", False)
+                    self.rows_exported = payload.get("rows_exported")
+                    self.query_seconds = payload["seconds"]
+                    self._finish("ok")
+                else:
+                    self.error, self.query_seconds = payload
+                    self._finish("error")
+                return True
+        except (EOFError, OSError):
+            # The worker went away without sending a result
+            pass
+
+        if not self.process.is_alive():
+            self.process.join()
+            if self.process.exitcode == TIMEOUT_EXIT_CODE:
+                self.error = f"Query timed out after {self.timeout} seconds."
+                self._finish("timeout")
+            elif self.process.exitcode == MEMORY_EXIT_CODE:
+                self.error = f"Query exceeded the memory limit of {self.memory_limit_mb} MB."
+                self._finish("memory limit")
+            else:
+                self.error = f"Query worker exited unexpectedly (exit code {self.process.exitcode})."
+                self._finish("error")
+            return True
+
+        # Fallback in case the worker watchdog could not stop the query itself
+        if self.elapsed() > self.timeout + 5 * POLL_INTERVAL_SECONDS:
+            self.cancel(f"Query timed out after {self.timeout} seconds.", status="timeout")
+            return True
+        return False
+
+    # Stop the worker process if it is still running
+    def cancel(self, reason="Query cancelled.", status="cancelled"):
+        if self.done:
+            return
+        self.error = reason
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(1)
+            if self.process.is_alive():
+                self.process.kill()
+                self.process.join()
+        self._finish(status)
+
+    def _finish(self, status):
+        self.done = True
+        self.status = status
+        self._conn.close()
+        if self.export_path and status != "ok":
+            # A stopped or failed export leaves no file behind
+            discard_export(self.export_path)
+        elapsed = self.query_seconds if self.query_seconds is not None else self.elapsed()
+        if self.slow_query_log is not None and elapsed >= self.slow_query_threshold:
+            row_count = len(self.result_df) if self.result_df is not None else self.rows_exported
+            self.slow_query_log.record(self.source, self.query, elapsed, self.plan_lines, self.table_sizes, row_count,
+                                       status, self.engine)
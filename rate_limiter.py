@@ -0,0 +1,171 @@
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+# Request rate caps (requests per second) and bursts for each endpoint family.
+# Endpoints are grouped by the first segment of their path, e.g. "transactions/asset/7".
+DEFAULT_RATE_LIMITS = {
+    "users": {"rate": 20.0, "burst": 20},
+    "portfolios": {"rate": 20.0, "burst": 20},
+    "assets": {"rate": 20.0, "burst": 20},
+    "transactions": {"rate": 10.0, "burst": 10},
+    "default": {"rate": 20.0, "burst": 20},
+}
+
+# Bounds for the adaptive number of concurrent requests per endpoint family
+MIN_CONCURRENCY = 1
+MAX_CONCURRENCY = 16
+INITIAL_CONCURRENCY = 4
+
+# A response slower than this multiple of the fastest recent response counts as congestion
+LATENCY_TOLERANCE = 2.0
+
+# Status codes that mean the backend is overloaded and the request can be retried
+THROTTLE_STATUSES = (429, 503)
+
+# Backoff used when a throttling response has no Retry-After header
+DEFAULT_BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 60.0
+
+
+# Function to get the endpoint family of an API endpoint
+def endpoint_family(endpoint):
+    family = endpoint.lstrip("/").split("/", 1)[0].split("?", 1)[0]
+    return family if family in DEFAULT_RATE_LIMITS else "default"
+
+
+# Function to parse a Retry-After header, given either in seconds or as an HTTP date
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), MAX_BACKOFF_SECONDS)
+
+
+# Token bucket capping the request rate. acquire() blocks until a token is available.
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# Client-side limiter for one endpoint family. The number of concurrent requests adapts with
+# AIMD: it grows by about one per round trip while responses are fast, shrinks by 10% when
+# latency rises well above the fastest recent response, and halves on 429/503 responses,
+# which also pause the family until Retry-After has passed.
+class AdaptiveLimiter:
+    def __init__(self, family, rate, burst):
+        self.family = family
+        self.bucket = TokenBucket(rate, burst)
+        self.limit = float(INITIAL_CONCURRENCY)
+        self.in_flight = 0
+        self.min_latency = None
+        self.paused_until = 0.0
+        self.requests = 0
+        self.throttled = 0
+        self._cond = threading.Condition()
+
+    # Function to wait for a request slot. Returns the start time to pass to release().
+    def acquire(self):
+        with self._cond:
+            while True:
+                pause = self.paused_until - time.monotonic()
+                if pause > 0:
+                    self._cond.wait(pause)
+                elif self.in_flight >= int(self.limit):
+                    self._cond.wait()
+                else:
+                    break
+            self.in_flight += 1
+        self.bucket.acquire()
+        return time.monotonic()
+
+    # Function to release a slot and adapt the concurrency limit to the response
+    def release(self, started, status_code=None, retry_after=None):
+        latency = time.monotonic() - started
+        with self._cond:
+            self.in_flight -= 1
+            self.requests += 1
+            if status_code in THROTTLE_STATUSES:
+                self.throttled += 1
+                self.limit = max(MIN_CONCURRENCY, self.limit / 2)
+                backoff = parse_retry_after(retry_after)
+                self.paused_until = max(self.paused_until,
+                                        time.monotonic() + (backoff if backoff is not None else DEFAULT_BACKOFF_SECONDS))
+            elif status_code is None:
+                # Connection errors and timeouts
+                self.limit = max(MIN_CONCURRENCY, self.limit / 2)
+            else:
+                # Let the baseline drift up slowly so it follows the backend over time
+                if self.min_latency is None or latency < self.min_latency:
+                    self.min_latency = latency
+                else:
+                    self.min_latency *= 1.01
+                if latency > LATENCY_TOLERANCE * self.min_latency:
+                    self.limit = max(MIN_CONCURRENCY, self.limit * 0.9)
+                else:
+                    self.limit = min(MAX_CONCURRENCY, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "family": self.family,
+                "concurrency_limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "rate_limit_per_second": self.bucket.rate,
+                "min_latency_ms": round(self.min_latency * 1000, 1) if self.min_latency is not None else None,
+                "paused_seconds": round(max(0.0, self.paused_until - time.monotonic()), 1),
+                "requests": self.requests,
+                "throttled": self.throttled,
+            }
+
+
+# Limiters are shared by every session on this server, since they protect the same backend
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+# Function to get the limiter for the endpoint family of an endpoint
+def get_limiter(endpoint):
+    family = endpoint_family(endpoint)
+    with _limiters_lock:
+        if family not in _limiters:
+            config = DEFAULT_RATE_LIMITS[family]
+            _limiters[family] = AdaptiveLimiter(family, config["rate"], config["burst"])
+        return _limiters[family]
+
+
+# Function to change the rate cap of an endpoint family
+def configure_rate_limit(family, rate, burst=None):
+    DEFAULT_RATE_LIMITS[family] = {"rate": float(rate), "burst": burst or max(1, int(rate))}
+    with _limiters_lock:
+        _limiters.pop(family, None)
+
+
+# Function to describe the state of every limiter
+def limiter_stats():
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return [limiter.stats() for limiter in limiters]
@@ -0,0 +1,398 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+from fact_table import FACT_TABLE
+
+# HyperLogLog sketches use 2^HLL_PRECISION registers: about 0.8% standard error on distinct counts
+HLL_PRECISION = 14
+
+# Count-Min sketches overestimate a count by at most CM_EPSILON * rows, with probability 1 - CM_DELTA
+CM_EPSILON = 0.001
+CM_DELTA = 0.01
+
+# Number of counters of the Misra-Gries summaries that track heavy-hitter candidates
+HEAVY_HITTER_COUNTERS = 256
+
+# Size of the KLL quantile sketches. Larger is more accurate: 200 gives about 1.3% rank error.
+KLL_K = 200
+
+# Rows kept per stratum in the stratified samples
+SAMPLE_ROWS_PER_STRATUM = 2000
+
+# Column each table's sample is stratified by (None for a simple random sample).
+# Sketches of the fact table summarize its transaction rows only.
+STRATA_COLUMNS = {
+    "users": None,
+    "portfolios": "portfolio_type",
+    "assets": "asset_type",
+    "transactions": "transaction_type",
+    FACT_TABLE: "asset_type",
+}
+
+# z-score of the 95% confidence intervals
+Z_95 = 1.96
+
+
+# Function to hash the values of a column to 64 bits. Equal values get equal hashes.
+def hash_values(series):
+    try:
+        return pd.util.hash_pandas_object(series, index=False).to_numpy()
+    except TypeError:
+        # Unhashable cell values such as lists
+        return pd.util.hash_pandas_object(series.astype(str), index=False).to_numpy()
+
+
+# Function to hash every row of a table
+def hash_rows(df):
+    try:
+        return pd.util.hash_pandas_object(df, index=False).to_numpy()
+    except TypeError:
+        return pd.util.hash_pandas_object(df.astype(str), index=False).to_numpy()
+
+
+# HyperLogLog sketch of the number of distinct values
+class HyperLogLog:
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def update(self, hashes):
+        if not len(hashes):
+            return
+        suffix_bits = 64 - self.precision
+        index = (hashes >> np.uint64(suffix_bits)).astype(np.intp)
+        suffix = (hashes & np.uint64((1 << suffix_bits) - 1)).astype(np.float64)
+        # Position of the leftmost 1 bit of the suffix; frexp is exact, unlike log2
+        rank = (suffix_bits + 1 - np.frexp(suffix)[1]).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            return m * math.log(m / zeros)
+        return raw
+
+    @property
+    def relative_error(self):
+        return 1.04 / math.sqrt(len(self.registers))
+
+
+# Count-Min sketch of value frequencies, addressed by value hashes. Never underestimates.
+class CountMinSketch:
+    def __init__(self, epsilon=CM_EPSILON, delta=CM_DELTA):
+        self.width = math.ceil(math.e / epsilon)
+        self.depth = math.ceil(math.log(1 / delta))
+        self.counts = np.zeros((self.depth, self.width), dtype=np.int64)
+        self.total = 0
+        self.epsilon = epsilon
+
+    def _columns(self, hashes):
+        low = hashes & np.uint64(0xFFFFFFFF)
+        high = hashes >> np.uint64(32)
+        width = np.uint64(self.width)
+        return [((low + np.uint64(row) * high) % width).astype(np.intp) for row in range(self.depth)]
+
+    def update(self, hashes):
+        for row, columns in enumerate(self._columns(hashes)):
+            self.counts[row] += np.bincount(columns, minlength=self.width)
+        self.total += len(hashes)
+
+    def estimate(self, hashes):
+        return np.min([self.counts[row, columns] for row, columns in enumerate(self._columns(hashes))], axis=0)
+
+    # Largest amount by which estimate() may overcount, with probability 1 - CM_DELTA
+    @property
+    def max_overcount(self):
+        return self.epsilon * self.total
+
+
+# Misra-Gries summary keeping the candidates for the most frequent values. Every value more
+# frequent than `error` is kept, and its counter undercounts it by at most `error`.
+class HeavyHitters:
+    def __init__(self, counters=HEAVY_HITTER_COUNTERS):
+        self.counters = counters
+        self.counts = pd.Series(dtype="int64")
+        self.labels = {}
+        self.error = 0
+
+    def update(self, values, hashes):
+        codes, unique = pd.factorize(hashes)
+        # A row of each distinct hash in the batch, to take its value from
+        positions = np.empty(len(unique), dtype=np.intp)
+        positions[codes] = np.arange(len(codes))
+        counts = self.counts.add(pd.Series(np.bincount(codes), index=unique), fill_value=0).astype("int64")
+        if len(counts) > self.counters:
+            # Merging two summaries: subtract the (counters + 1)-th largest count from every counter
+            threshold = int(counts.nlargest(self.counters + 1).iloc[-1])
+            counts = counts[counts > threshold] - threshold
+            self.error += threshold
+        self.counts = counts
+        # Keep the value of every tracked hash
+        labels = {h: self.labels[h] for h in counts.index if h in self.labels}
+        missing = counts.index[~counts.index.isin(list(labels))].to_numpy(dtype=np.uint64)
+        rows = positions[pd.Index(unique).get_indexer(missing)]
+        labels.update(zip(missing.tolist(), np.asarray(values)[rows].tolist()))
+        self.labels = labels
+
+
+# KLL sketch of the distribution of a numeric column, for quantiles with bounded rank error
+class KLLSketch:
+    def __init__(self, k=KLL_K, seed=0):
+        self.k = k
+        self.levels = [np.empty(0)]
+        self.count = 0
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, math.ceil(self.k * (2 / 3) ** depth))
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.count += len(values)
+        self._compress()
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                # An odd item out stays at this level
+                leftover = items[:len(items) % 2]
+                items = items[len(items) % 2:]
+                promoted = items[self._rng.integers(2)::2]
+                self.levels[level] = leftover
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+                # Capacities of lower levels shrink when a level is added, so start over
+                level = 0
+                continue
+            level += 1
+
+    def quantiles(self, fractions):
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2.0 ** level) for level, items in enumerate(self.levels)])
+        order = np.argsort(values, kind="stable")
+        values, ranks = values[order], np.cumsum(weights[order]) / weights.sum()
+        positions = np.searchsorted(ranks, np.clip(fractions, 0, 1), side="left")
+        return values[np.minimum(positions, len(values) - 1)]
+
+    # Normalized rank error of a single quantile at about 99% confidence (Karnin, Lang & Liberty)
+    @property
+    def rank_error(self):
+        return 2.296 / self.k ** 0.9723
+
+
+# Sketches of one column: distinct count for every column, frequencies for discrete columns
+# and quantiles for numeric ones
+class ColumnSketch:
+    def __init__(self, dtype):
+        kind = getattr(dtype, "kind", "O")
+        self.distinct = HyperLogLog()
+        self.frequencies = CountMinSketch() if kind != "f" else None
+        self.heavy_hitters = HeavyHitters() if kind != "f" else None
+        self.quantiles = KLLSketch() if kind in "iuf" else None
+        self.count = 0
+
+    def update(self, series):
+        series = series.dropna()
+        if series.empty:
+            return
+        hashes = hash_values(series)
+        self.count += len(series)
+        self.distinct.update(hashes)
+        if self.frequencies is not None:
+            self.frequencies.update(hashes)
+            self.heavy_hitters.update(series.to_numpy(), hashes)
+        if self.quantiles is not None:
+            self.quantiles.update(series.to_numpy(dtype="float64", na_value=np.nan))
+
+
+# Sketches and a stratified sample of one table. Rows can be added, but not removed.
+class TableSketch:
+    def __init__(self, strata_column=None):
+        self.strata_column = strata_column
+        self.rows = 0
+        self.columns = {}
+        self.strata_sizes = pd.Series(dtype="int64")
+        self.sample = pd.DataFrame()
+
+    def update(self, df, hashes):
+        self.rows += len(df)
+        for col in df.columns:
+            if col not in self.columns:
+                self.columns[col] = ColumnSketch(df[col].dtype)
+            self.columns[col].update(df[col])
+
+        strata = self._strata(df)
+        self.strata_sizes = self.strata_sizes.add(strata.value_counts(dropna=False), fill_value=0).astype("int64")
+        # The sample of each stratum is the rows with the smallest hashes: a uniform sample that
+        # stays uniform as rows are added
+        rows = df.assign(_stratum=strata.to_numpy(), _sample_key=hashes)
+        combined = pd.concat([self.sample, rows], ignore_index=True) if not self.sample.empty else rows
+        self.sample = (
+            combined.sort_values("_sample_key")
+            .groupby("_stratum", dropna=False, sort=False)
+            .head(SAMPLE_ROWS_PER_STRATUM)
+            .reset_index(drop=True)
+        )
+
+    def _strata(self, df):
+        if self.strata_column and self.strata_column in df.columns:
+            return df[self.strata_column].astype(str)
+        return pd.Series("all", index=df.index)
+
+
+# Sketches of the loaded tables. Call mark_changed(table) after a table in the store changes,
+# which only records it; refresh(store) brings the sketches of changed tables up to date, so
+# loading data costs nothing until approximate answers are asked for. When rows were only
+# added, just the new rows are fed to the sketches; any other change rebuilds that table's
+# sketches.
+class SketchCatalog:
+    def __init__(self):
+        self._tables = {}
+        self._row_hashes = {}
+        self._changed = set()
+
+    def __contains__(self, table):
+        return table in self._tables
+
+    def tables(self):
+        return list(self._tables)
+
+    def get(self, table):
+        return self._tables[table]
+
+    # Function to record that a table changed, without touching its sketches yet
+    def mark_changed(self, table):
+        self._changed.add(table)
+
+    # Function to update the sketches of every table changed since the last refresh
+    def refresh(self, store):
+        while self._changed:
+            self.update(store, self._changed.pop())
+
+    def update(self, store, table):
+        df = store.get(table)
+        if table == FACT_TABLE and "grain" in df.columns:
+            df = df[df["grain"] == "transaction"]
+        if df.empty:
+            self._tables.pop(table, None)
+            self._row_hashes.pop(table, None)
+            return
+
+        hashes = hash_rows(df)
+        old = self._row_hashes.get(table)
+        # pandas' hash-table isin is much faster than np.isin on large hash arrays
+        if old is not None and table in self._tables and pd.Series(old).isin(hashes).all():
+            new_rows = ~pd.Series(hashes).isin(old).to_numpy()
+            if new_rows.any():
+                self._tables[table].update(df[new_rows], hashes[new_rows])
+        else:
+            sketch = TableSketch(STRATA_COLUMNS.get(table))
+            sketch.update(df, hashes)
+            self._tables[table] = sketch
+        self._row_hashes[table] = hashes
+
+
+# Function to estimate the number of distinct values of a column
+def approx_distinct(sketch, column):
+    hll = sketch.columns[column].distinct
+    estimate = hll.estimate()
+    margin = Z_95 * hll.relative_error * estimate
+    return pd.DataFrame([{
+        "column": column,
+        "distinct_estimate": round(estimate),
+        "lower_95": max(0, math.floor(estimate - margin)),
+        "upper_95": math.ceil(estimate + margin),
+    }])
+
+
+# Function to estimate the most frequent values of a column with their counts. The true count
+# lies between lower_bound and upper_bound (lower_bound holds with 99% probability).
+def approx_top_k(sketch, column, k=10):
+    col = sketch.columns[column]
+    if col.heavy_hitters is None:
+        raise ValueError(f"Top values are not tracked for the numeric column {column}")
+    candidates = col.heavy_hitters.counts
+    if candidates.empty:
+        return pd.DataFrame(columns=["value", "estimated_count", "lower_bound", "upper_bound"])
+    cm_counts = col.frequencies.estimate(candidates.index.to_numpy(dtype=np.uint64))
+    mg_counts = candidates.to_numpy()
+    # Misra-Gries counters undercount by at most their error; Count-Min never undercounts
+    lower = np.maximum(mg_counts, cm_counts - math.floor(col.frequencies.max_overcount))
+    upper = np.minimum(cm_counts, mg_counts + col.heavy_hitters.error)
+    result = pd.DataFrame({
+        "value": [col.heavy_hitters.labels[h] for h in candidates.index],
+        "estimated_count": (lower + upper) // 2,
+        "lower_bound": lower,
+        "upper_bound": upper,
+    })
+    return result.sort_values(["estimated_count", "upper_bound"], ascending=False).head(k).reset_index(drop=True)
+
+
+# Function to estimate quantiles of a numeric column. The bounds are the values at the
+# quantile plus/minus the sketch's rank error.
+def approx_quantiles(sketch, column, fractions=(0.01, 0.25, 0.5, 0.75, 0.99)):
+    kll = sketch.columns[column].quantiles
+    if kll is None:
+        raise ValueError(f"Quantiles are only tracked for numeric columns, not {column}")
+    fractions = np.asarray(fractions, dtype=float)
+    return pd.DataFrame({
+        "quantile": fractions,
+        "value": kll.quantiles(fractions),
+        "lower_bound": kll.quantiles(fractions - kll.rank_error),
+        "upper_bound": kll.quantiles(fractions + kll.rank_error),
+    })
+
+
+# Function to estimate the average and sum of a numeric column from the stratified sample,
+# with 95% confidence intervals
+def approx_mean(sketch, column):
+    if sketch.columns[column].quantiles is None:
+        raise ValueError(f"Averages are only estimated for numeric columns, not {column}")
+    sample = sketch.sample
+    values = pd.to_numeric(sample[column], errors="coerce").astype("float64")
+    groups = values.groupby(sample["_stratum"], sort=False)
+    stats = pd.DataFrame({"mean": groups.mean(), "var": groups.var(ddof=1), "n": groups.count(),
+                          "sampled": groups.size()})
+    # Rows of each stratum with a value, estimated from the share of sampled rows with one
+    stats["size"] = sketch.strata_sizes.reindex(stats.index).fillna(0) * stats["n"] / stats["sampled"]
+    stats = stats[stats["n"] > 0]
+    if stats.empty:
+        raise ValueError(f"No sampled values in {column}")
+    weights = stats["size"] / stats["size"].sum()
+    mean = float((weights * stats["mean"]).sum())
+    # Variance of the stratified mean, with the finite population correction
+    variance = float((weights ** 2 * (1 - stats["n"] / stats["size"]) * stats["var"].fillna(0) / stats["n"]).sum())
+    margin = Z_95 * math.sqrt(max(variance, 0.0))
+    rows = sketch.columns[column].count
+    return pd.DataFrame([
+        {"aggregate": f"AVG({column})", "estimate": mean, "lower_95": mean - margin, "upper_95": mean + margin},
+        {"aggregate": f"SUM({column})", "estimate": mean * rows, "lower_95": (mean - margin) * rows,
+         "upper_95": (mean + margin) * rows},
+    ])
+
+
+# Approximate answers offered in the Advanced SQL tab, with how to read their bounds
+APPROX_ANSWERS = {
+    "Distinct Count": (approx_distinct, "HyperLogLog estimate; the bounds are a 95% confidence interval."),
+    "Top 10 Values": (approx_top_k, "Count-Min and Misra-Gries estimates; the true count lies between the "
+                                    "bounds with 99% probability."),
+    "Quantiles": (approx_quantiles, "KLL estimates; the bounds are the values at the quantile plus or minus "
+                                    "the sketch's rank error (99% confidence)."),
+    "Average and Sum": (approx_mean, "Estimated from the stratified sample; the bounds are a 95% confidence "
+                                     "interval."),
+}
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import time
+
+import pandas as pd
+
+
+# Function to get the sort key of a record, so records hash in a stable order
+def _record_id(record, id_key):
+    value = record.get(id_key)
+    return (value is None, value if value is not None else 0)
+
+
+# Function to hash records in id order. Returns the hash of all records and the hash of
+# the records at or below the watermark, computed in a single pass.
+def hash_records(records, id_key="id", watermark=None):
+    hasher = hashlib.sha256()
+    old_digest = hasher.copy().hexdigest()
+    for record in records:
+        record_id = record.get(id_key)
+        hasher.update(json.dumps(record, sort_keys=True, separators=(",", ":"), default=str).encode())
+        hasher.update(b"\n")
+        if watermark is not None and record_id is not None and record_id <= watermark:
+            old_digest = hasher.hexdigest()
+    return hasher.hexdigest(), old_digest
+
+
+# Function to merge one entity's records (e.g. the transactions of one asset) into a table.
+#
+# The ledger remembers, per entity, the high-water mark (max id and max date_key) and a
+# hash of the records seen at the last sync:
+# - if the hash is unchanged the table is left as it is,
+# - if only records past the watermark are new, only those are flattened and appended,
+# - otherwise (records edited or deleted) the entity's rows are rebuilt.
+#
+# Returns the updated table and a summary of what was done.
+def sync_entity(ledger, df, table, entity_column, entity_id, records, flatten, id_key="id", date_key=None):
+    key = f"{table}:{entity_id}"
+    entry = ledger.get(key)
+    records = sorted(records, key=lambda r: _record_id(r, id_key))
+    watermark = entry["watermark_id"] if entry else None
+    content_hash, old_hash = hash_records(records, id_key, watermark)
+
+    have_rows = not df.empty and entity_column in df.columns and (df[entity_column] == entity_id).any()
+    if entry and entry["content_hash"] == content_hash and (have_rows or not records):
+        return df, {"status": "unchanged", "rows_merged": 0, "rows_total": len(records)}
+
+    if entry and have_rows and old_hash == entry["content_hash"]:
+        # Only records past the watermark are new
+        status = "appended"
+        new_records = [r for r in records if r.get(id_key) is not None and r[id_key] > watermark]
+    else:
+        status = "replaced" if entry else "initial"
+        new_records = records
+        if not df.empty and entity_column in df.columns:
+            df = df[df[entity_column] != entity_id]
+
+    new_rows = pd.DataFrame(flatten(new_records))
+    if not new_rows.empty:
+        new_rows[entity_column] = entity_id
+        df = new_rows if df.empty else pd.concat([df, new_rows], ignore_index=True)
+    df = df.reset_index(drop=True)
+
+    ids = [r[id_key] for r in records if r.get(id_key) is not None]
+    dates = [str(r[date_key]) for r in records if date_key and r.get(date_key) is not None]
+    ledger[key] = {
+        "table": table,
+        "entity_id": entity_id,
+        "watermark_id": max(ids) if ids else None,
+        "watermark_date": max(dates) if dates else None,
+        "content_hash": content_hash,
+        "row_count": len(records),
+        "synced_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    return df, {"status": status, "rows_merged": len(new_records), "rows_total": len(records)}
+
+
+# Function to drop the ledger entries of a table, forcing its next sync to rebuild it
+def reset_table(ledger, table):
+    for key in [k for k, entry in ledger.items() if entry["table"] == table]:
+        del ledger[key]
+
+
+# Function to show the ledger as a DataFrame
+def ledger_frame(ledger):
+    return pd.DataFrame(list(ledger.values()))
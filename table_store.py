@@ -0,0 +1,221 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+from collections.abc import Mapping
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:  # Without pyarrow, spilled tables are pickled instead
+    pa = None
+    feather = None
+
+# Memory budgets for loaded tables and cached query results. Tables that have not been used
+# recently are spilled to disk when a session, or the whole process, goes over its budget.
+SESSION_MEMORY_BUDGET_MB = int(os.environ.get("SESSION_MEMORY_BUDGET_MB", 512))
+PROCESS_MEMORY_BUDGET_MB = int(os.environ.get("PROCESS_MEMORY_BUDGET_MB", 2048))
+
+# Spilled tables are written here, one directory per session
+SPILL_DIR = os.path.join(tempfile.gettempdir(), "finance_frontend_spill")
+
+# Every store in this process, so the process budget can be enforced across sessions
+_stores = weakref.WeakSet()
+_lock = threading.RLock()
+
+
+# Function to measure the memory used by a DataFrame, including the contents of string columns
+def frame_bytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+# A table held by a TableStore, either in memory or spilled to a file. A table spilled to
+# Feather is memory-mapped as an Arrow table once it is read again.
+class _Entry:
+    def __init__(self, df):
+        self.df = df
+        self.table = None
+        self.path = None
+        self.rows = len(df)
+        self.columns = list(df.columns)
+        self.bytes = frame_bytes(df)
+        self.last_used = time.monotonic()
+
+    @property
+    def in_memory(self):
+        return self.df is not None
+
+
+# Named DataFrames for one session with a memory budget. The least recently used tables are
+# spilled to columnar (Arrow/Feather) files when over budget and memory-mapped back on get().
+class TableStore:
+    def __init__(self, budget_mb=SESSION_MEMORY_BUDGET_MB):
+        self.budget_bytes = budget_mb * 1024 * 1024
+        self.spill_dir = os.path.join(SPILL_DIR, uuid.uuid4().hex)
+        self._entries = {}
+        # Remove the spill files once the session is gone
+        weakref.finalize(self, shutil.rmtree, self.spill_dir, True)
+        with _lock:
+            _stores.add(self)
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    # Function to store a table, replacing any previous version
+    def put(self, name, df):
+        with _lock:
+            self.drop(name)
+            self._entries[name] = _Entry(df)
+            self._enforce_budgets(keep=name)
+
+    # Function to get a table, reloading it from disk if it was spilled. Tables spilled to
+    # Feather stay memory-mapped: each call builds a new DataFrame over the mapped file, which
+    # the store does not keep. Pickled tables are read back into memory.
+    def get(self, name, default=None):
+        with _lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                return pd.DataFrame() if default is None else default
+            entry.last_used = time.monotonic()
+            if entry.in_memory:
+                return entry.df
+            if entry.path.endswith(".feather"):
+                if entry.table is None:
+                    entry.table = feather.read_table(entry.path, memory_map=True)
+                return _to_frame(entry.table)
+            entry.df = pd.read_pickle(entry.path)
+            self._enforce_budgets(keep=name)
+            return entry.df
+
+    # Function to remove a table and its spill file
+    def drop(self, name):
+        with _lock:
+            entry = self._entries.pop(name, None)
+            if entry is not None and entry.path and os.path.exists(entry.path):
+                entry.table = None
+                os.remove(entry.path)
+
+    # Function to list the stored tables that have rows, without loading them
+    def non_empty(self):
+        return [name for name, entry in self._entries.items() if entry.rows]
+
+    # Function to get the columns of a table without loading it
+    def columns(self, name):
+        entry = self._entries.get(name)
+        return entry.columns if entry else []
+
+    def memory_bytes(self):
+        return sum(entry.bytes for entry in self._entries.values() if entry.in_memory)
+
+    # Function to describe the stored tables and where they currently live
+    def stats(self):
+        now = time.monotonic()
+        return pd.DataFrame([
+            {
+                "table": name,
+                "rows": entry.rows,
+                "columns": len(entry.columns),
+                "size_mb": round(entry.bytes / (1024 * 1024), 2),
+                "location": "memory" if entry.in_memory else ("mapped" if entry.table is not None else "disk"),
+                "idle_seconds": round(now - entry.last_used, 1),
+            }
+            for name, entry in self._entries.items()
+        ])
+
+    # Function to spill one table to disk and free its memory
+    def _spill(self, name):
+        entry = self._entries[name]
+        if entry.path is None:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            entry.path = _dump(entry.df, os.path.join(self.spill_dir, uuid.uuid4().hex))
+        # Tables never change once stored, so an existing spill file is still current
+        entry.df = None
+
+    def _lru_candidates(self, keep):
+        return [
+            (entry.last_used, self, name)
+            for name, entry in self._entries.items()
+            if entry.in_memory and entry.rows and name != keep
+        ]
+
+    # Function to spill least recently used tables until this session and the process are within budget
+    def _enforce_budgets(self, keep):
+        for _, store, name in sorted(self._lru_candidates(keep), key=lambda c: c[0]):
+            if self.memory_bytes() <= self.budget_bytes:
+                break
+            store._spill(name)
+
+        process_budget = PROCESS_MEMORY_BUDGET_MB * 1024 * 1024
+        stores = list(_stores)
+        candidates = sorted((c for store in stores for c in store._lru_candidates(keep if store is self else None)),
+                            key=lambda c: c[0])
+        for _, store, name in candidates:
+            if sum(s.memory_bytes() for s in stores) <= process_budget:
+                break
+            store._spill(name)
+
+
+# Read-only mapping over the non-empty tables of a store. Tables are only loaded (and passed
+# through prepare) when they are actually read, so checking which tables exist does not
+# pull spilled tables back into memory.
+class StoreView(Mapping):
+    def __init__(self, store, names, prepare=None):
+        self.store = store
+        self.names = names
+        self.prepare = prepare
+        self._cache = {}
+
+    def __contains__(self, name):
+        return name in self.names and name in self.store.non_empty()
+
+    def __getitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        if name not in self._cache:
+            df = self.store.get(name)
+            self._cache[name] = self.prepare(df) if self.prepare else df
+        return self._cache[name]
+
+    def __iter__(self):
+        return (name for name in self.names if name in self)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+# Function to write a DataFrame to a spill file. Uses uncompressed Feather so it can be
+# memory-mapped on reload, and falls back to pickle for columns Arrow cannot represent.
+# The file holds a single record batch, so numeric columns can be read without copying.
+def _dump(df, path):
+    if feather is not None:
+        try:
+            feather.write_feather(df, path + ".feather", compression="uncompressed", chunksize=max(len(df), 1))
+            return path + ".feather"
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError, ValueError):
+            if os.path.exists(path + ".feather"):
+                os.remove(path + ".feather")
+    df.to_pickle(path + ".pkl")
+    return path + ".pkl"
+
+
+# Function to build a DataFrame over a memory-mapped Arrow table. Columns keep pointing into
+# the mapped file where pandas allows it: split_blocks keeps numeric columns from being copied
+# into consolidated blocks. List and struct columns would come back as numpy arrays, so they
+# are turned back into the Python lists and dicts they held.
+def _to_frame(table):
+    df = table.to_pandas(split_blocks=True)
+    for field in table.schema:
+        if pa.types.is_nested(field.type):
+            df[field.name] = pd.Series(table.column(field.name).to_pylist(), index=df.index, dtype=object)
+    return df
+
+
+# Function to get the memory used by all stores in this process
+def process_memory_bytes():
+    with _lock:
+        return sum(store.memory_bytes() for store in list(_stores))
@@ -0,0 +1,215 @@
+import base64
+import binascii
+import json
+import threading
+import time
+
+import requests
+
+from api_client import BASE_URL, APIError
+
+# Tokens are refreshed this many seconds before they expire
+REFRESH_MARGIN_SECONDS = 60
+
+# Refreshes are never scheduled sooner than this, even for tokens that arrive already expired
+MIN_REFRESH_DELAY_SECONDS = 5
+
+# Delay before retrying after a failed refresh. It doubles with each consecutive failure, up to
+# the maximum.
+REFRESH_RETRY_SECONDS = 10
+MAX_REFRESH_RETRY_SECONDS = 5 * 60
+
+# Tokens of sessions idle for longer than this are left to expire instead of being refreshed
+IDLE_TIMEOUT_SECONDS = 30 * 60
+
+
+# Function to post to an auth endpoint and return its (JWT, refresh token) pair. The refresh
+# token is None when the API does not issue one. Raises APIError when the request is rejected.
+def _authenticate(endpoint, payload, session=None):
+    http = session or requests
+    response = http.post(f"{BASE_URL}/auth/{endpoint}", headers={'Content-Type': 'application/json'},
+                         data=json.dumps(payload))
+    if response.status_code != 200:
+        try:
+            message = response.json().get('message', 'Unknown error')
+        except ValueError:
+            message = response.text or 'Unknown error'
+        raise APIError(response.status_code, message)
+    body = response.json()
+    if not body.get('token'):
+        raise APIError(response.status_code, f"The {endpoint} response has no token")
+    return body['token'], body.get('refreshToken')
+
+
+# Function to log in and return a (JWT, refresh token) pair
+def login(email, password, session=None):
+    return _authenticate("login", {'email': email, 'password': password}, session)
+
+
+# Function to exchange a refresh token for a new (JWT, refresh token) pair
+def refresh_session(refresh_token, session=None):
+    return _authenticate("refresh", {'refreshToken': refresh_token}, session)
+
+
+# Function to read the expiry time (seconds since the epoch) from a JWT's "exp" claim.
+# The signature is not checked; returns None for tokens without a readable expiry.
+def token_expiry(token):
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(claims["exp"])
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError, binascii.Error):
+        return None
+
+
+# Keeps a session's JWT valid. When the API issued a refresh token, the JWT is refreshed in a
+# background timer shortly before it expires, and synchronously when it is found expired or the
+# API rejects it with a 401. Refresh tokens are used once: each refresh returns a new one. The
+# password is never kept, so without a refresh token (or once it is rejected) the session
+# expires with its JWT and the user is asked to log in again.
+#
+# One manager is shared by all requests of a session, including worker threads: only one refresh
+# runs at a time, and requests that saw the same stale token reuse its result.
+class TokenManager:
+    def __init__(self, token=None, refresh_token=None, refresh_fn=refresh_session,
+                 refresh_margin=REFRESH_MARGIN_SECONDS):
+        self._refresh_fn = refresh_fn
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._token = None
+        self._refresh_token = refresh_token
+        self._expires_at = None
+        self._timer = None
+        self._closed = False
+        self.last_used = time.monotonic()
+        self.refreshes = 0
+        self.failures = 0
+        self.last_error = None
+        self._retry_at = 0.0
+        if token:
+            self._set_token(token)
+
+    @property
+    def expires_at(self):
+        with self._lock:
+            return self._expires_at
+
+    # True when the token can be renewed without asking the user to log in again
+    @property
+    def renewable(self):
+        with self._lock:
+            return self._refresh_token is not None
+
+    # True when the token has expired and cannot be renewed, so the user must log in again
+    @property
+    def expired(self):
+        with self._lock:
+            return self._closed or self._token is None or (
+                self._refresh_token is None and self._expires_at is not None and time.time() >= self._expires_at
+            )
+
+    # Function to get a valid token, refreshing it first if the current one has expired
+    def get(self):
+        with self._lock:
+            self.last_used = time.monotonic()
+            token, expires_at = self._token, self._expires_at
+            backing_off = time.monotonic() < self._retry_at
+        if token is None or (expires_at is not None and time.time() >= expires_at and not backing_off):
+            return self.refresh(stale=token)
+        return token
+
+    # Function to replace the token `stale`, e.g. after the API rejected it. When another thread
+    # already replaced it, the newer token is returned without refreshing again.
+    def refresh(self, stale=None):
+        with self._refresh_lock:
+            with self._lock:
+                if self._closed:
+                    raise APIError(401, "Logged out")
+                if self._token is not None and self._token != stale:
+                    return self._token
+                refresh_token = self._refresh_token
+            if refresh_token is None:
+                raise APIError(401, "Your session has expired. Please log in again.")
+            try:
+                token, refresh_token = self._refresh_fn(refresh_token)
+            except APIError as e:
+                self.last_error = str(e)
+                with self._lock:
+                    self._backoff()
+                    if e.status_code in (400, 401, 403):
+                        # The refresh token was rejected, so only a new login can renew the session
+                        self._refresh_token = None
+                raise
+            except Exception as e:
+                self.last_error = str(e)
+                with self._lock:
+                    self._backoff()
+                raise
+            self.refreshes += 1
+            self.last_error = None
+            with self._lock:
+                self._refresh_token = refresh_token
+            self._set_token(token)
+            return token
+
+    # Function to stop refreshing and forget the token, e.g. on logout
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._token = None
+            self._refresh_token = None
+            self._expires_at = None
+            if self._timer:
+                self._timer.cancel()
+
+    def _set_token(self, token):
+        with self._lock:
+            if self._closed:
+                return
+            self._token = token
+            self._expires_at = token_expiry(token)
+            if self._expires_at is None:
+                return
+            remaining = self._expires_at - time.time()
+            if remaining > 0:
+                self.failures = 0
+                self._retry_at = 0.0
+                # Short-lived tokens are refreshed halfway through their lifetime instead
+                delay = max(remaining - self.refresh_margin, remaining / 2, MIN_REFRESH_DELAY_SECONDS)
+            else:
+                # Expired on arrival, e.g. because of clock skew: refreshing again right away
+                # would most likely get another such token
+                delay = self._backoff()
+            if self._refresh_token is not None:
+                self._schedule(delay)
+
+    # Function to count a failed refresh and return the delay before the next attempt.
+    # Call with the lock held.
+    def _backoff(self):
+        self.failures += 1
+        delay = min(REFRESH_RETRY_SECONDS * 2 ** (self.failures - 1), MAX_REFRESH_RETRY_SECONDS)
+        self._retry_at = time.monotonic() + delay
+        return delay
+
+    def _schedule(self, delay):
+        if self._timer:
+            self._timer.cancel()
+        self._timer = threading.Timer(max(delay, 0), self._refresh_in_background)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._closed or self._token is None:
+                return
+            if time.monotonic() - self.last_used > IDLE_TIMEOUT_SECONDS:
+                # Abandoned session: do not keep refreshing its token
+                return
+            stale = self._token
+        try:
+            self.refresh(stale=stale)
+        except Exception:
+            with self._lock:
+                if not self._closed and self._refresh_token is not None:
+                    self._schedule(max(self._retry_at - time.monotonic(), MIN_REFRESH_DELAY_SECONDS))
@@ -0,0 +1,144 @@
+import math
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import pandas as pd
+
+from api_client import APIError
+
+# Lookup kinds: the df_users column the index is built on and the API endpoint used for misses
+LOOKUP_KINDS = {
+    "Email": {"column": "email", "endpoint": "users/email/{}"},
+    "Account Number": {"column": "account_number", "endpoint": "users/account/{}"},
+}
+
+# Number of API lookups run at the same time for identifiers missing from the local index
+DEFAULT_MAX_WORKERS = 8
+
+# Assumed duration of one API lookup while the health probe has not measured any latency
+DEFAULT_LOOKUP_SECONDS = 0.5
+
+# Error recorded for identifiers not looked up because the session would expire first
+SESSION_EXPIRES_ERROR = "Skipped: the session expires before the lookups could finish"
+
+
+# Function to normalize an identifier so lookups ignore case and surrounding whitespace for emails
+def normalize_identifier(kind, value):
+    value = str(value).strip()
+    return value.lower() if kind == "Email" else value
+
+
+# Function to split pasted text (one identifier per line, or separated by commas/spaces)
+# into unique identifiers, keeping their order
+def parse_identifiers(text):
+    seen = set()
+    identifiers = []
+    for value in re.split(r"[\s,;]+", text):
+        if value and value not in seen:
+            seen.add(value)
+            identifiers.append(value)
+    return identifiers
+
+
+# Function to build a hash index mapping normalized identifiers to row positions in df_users
+def build_index(df_users, kind):
+    column = LOOKUP_KINDS[kind]["column"]
+    if df_users.empty or column not in df_users.columns:
+        return {}
+    keys = (normalize_identifier(kind, v) for v in df_users[column])
+    return {key: position for position, key in enumerate(keys)}
+
+
+# Function to look up one identifier through the API. Returns (identifier, user or None, error or None).
+# With a health probe, the lookup first waits while the backend is down.
+def _fetch_user(fetch, kind, identifier, probe=None):
+    endpoint = LOOKUP_KINDS[kind]["endpoint"].format(quote(identifier, safe=""))
+    if probe is not None and not probe.wait_while_down():
+        return identifier, None, "Skipped: the API is down"
+    try:
+        user = fetch(endpoint)
+        return identifier, (user or None), None
+    except APIError as e:
+        if e.status_code == 404:
+            return identifier, None, None
+        return identifier, None, str(e)
+    except Exception as e:
+        return identifier, None, f"Request error: {e}"
+
+
+# Function to estimate how long fetching `count` users takes with max_workers concurrent lookups.
+# Uses the slowest p90 latency measured by the health probe, when there is one.
+def estimate_fetch_seconds(count, max_workers, probe=None):
+    lookup_seconds = DEFAULT_LOOKUP_SECONDS
+    if probe is not None:
+        latencies = [target["p90_ms"] for target in probe.snapshot()["targets"] if target["p90_ms"] is not None]
+        if latencies:
+            lookup_seconds = max(latencies) / 1000
+    return math.ceil(count / max_workers) * lookup_seconds
+
+
+# Function to resolve many emails or account numbers at once. Identifiers found in the local
+# index are answered from df_users; only the misses are fetched, concurrently, through
+# fetch(endpoint), which must be safe to call from worker threads.
+#
+# Returns the matched users (one row per identifier found), the identifiers that do not
+# exist, any request errors, and the users fetched from the API (flattened) for merging.
+# With a HealthProbe, fewer lookups run at the same time while the backend is degraded.
+# When `deadline` (seconds since the epoch) is given, e.g. the expiry of a token that cannot be
+# renewed, the misses are only fetched if that is expected to finish before it; otherwise none
+# of them is requested and each gets SESSION_EXPIRES_ERROR.
+def bulk_lookup(df_users, kind, identifiers, fetch, flatten, max_workers=DEFAULT_MAX_WORKERS, probe=None,
+                deadline=None):
+    index = build_index(df_users, kind)
+    local_positions = []
+    misses = []
+    for identifier in identifiers:
+        position = index.get(normalize_identifier(kind, identifier))
+        if position is None:
+            misses.append(identifier)
+        else:
+            local_positions.append((identifier, position))
+
+    fetched = []
+    not_found = []
+    errors = {}
+    if misses:
+        if probe is not None:
+            max_workers = probe.recommended_workers(max_workers)
+        max_workers = min(max_workers, len(misses))
+        if deadline is not None and time.time() + estimate_fetch_seconds(len(misses), max_workers, probe) > deadline:
+            errors = {identifier: SESSION_EXPIRES_ERROR for identifier in misses}
+            misses = []
+    if misses:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for identifier, user, error in executor.map(lambda i: _fetch_user(fetch, kind, i, probe), misses):
+                if error:
+                    errors[identifier] = error
+                elif user is None:
+                    not_found.append(identifier)
+                else:
+                    fetched.append((identifier, user))
+
+    local_rows = df_users.iloc[[position for _, position in local_positions]].copy()
+    local_rows.insert(0, "lookup", [identifier for identifier, _ in local_positions])
+    local_rows.insert(1, "source", "local")
+    fetched_users = pd.DataFrame(flatten([user for _, user in fetched]))
+    fetched_rows = fetched_users.copy()
+    fetched_rows.insert(0, "lookup", [identifier for identifier, _ in fetched])
+    fetched_rows.insert(1, "source", "api")
+    matches = pd.concat([local_rows, fetched_rows], ignore_index=True)
+    return matches, not_found, errors, fetched_users
+
+
+# Function to merge users fetched from the API back into df_users, replacing rows with the same id
+def merge_users(df_users, fetched_users):
+    if fetched_users.empty:
+        return df_users
+    if df_users.empty:
+        return fetched_users.reset_index(drop=True)
+    merged = pd.concat([df_users, fetched_users], ignore_index=True)
+    if "id" in merged.columns:
+        merged = merged.drop_duplicates(subset="id", keep="last")
+    return merged.reset_index(drop=True)